@@ -22,8 +22,12 @@ import hashlib
 import hmac
 import base64
 import re
+import calendar
 import atexit
-import argparse
+import queue
+import threading
+from collections import OrderedDict, deque
+from contextlib import contextmanager
 from datetime import datetime, timedelta, timezone
 import urllib.parse
 from urllib.parse import urlparse, parse_qs, unquote
@@ -31,10 +35,13 @@ from urllib.parse import urlparse, parse_qs, unquote
 
 # --- Third-party Libraries ---
 import requests
+import orjson
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from flask import Flask, request, jsonify
 from dotenv import load_dotenv
-from apscheduler.schedulers.background import BackgroundScheduler
 import feedparser
+import lxml.html
 
 # --- Newspaper3k for article scraping ---
 from newspaper import Article, Config
@@ -80,11 +87,22 @@ class Config:
     
     SELENIUM_HEADLESS = os.getenv("SELENIUM_HEADLESS", "true").lower() == "true"
     NEWS_FETCH_DAYS_LIMIT = int(os.getenv("NEWS_FETCH_DAYS_LIMIT", "3"))
+    NEWS_FETCH_MAX_WORKERS = int(os.getenv("NEWS_FETCH_MAX_WORKERS", "8"))
+    LLM_CONCURRENCY = int(os.getenv("LLM_CONCURRENCY", "4"))
+    LLM_REQUESTS_PER_MINUTE = float(os.getenv("LLM_REQUESTS_PER_MINUTE", "20"))
+    LLM_STREAM = os.getenv("LLM_STREAM", "false").lower() == "true"
+    LLM_READ_TIMEOUT_SEC = float(os.getenv("LLM_READ_TIMEOUT_SEC", "60"))
+    LLM_TIMEOUT_SEC = float(os.getenv("LLM_TIMEOUT_SEC", "980"))
+    NEWS_CONCURRENCY = int(os.getenv("NEWS_CONCURRENCY", "3"))
+    NEWS_WORKERS = int(os.getenv("NEWS_WORKERS", "4"))
     ALLOW_REASONING_FALLBACK = os.getenv("ALLOW_REASONING_FALLBACK", "false").lower() == "true"
     LINE_MIN_PUSH_INTERVAL_SEC = float(os.getenv("LINE_MIN_PUSH_INTERVAL_SEC", "1.2"))
     SHOW_THINKING_PROCESS = os.getenv("SHOW_THINKING_PROCESS", "false").lower() == "true"
     FALLBACK_ON_EMPTY = os.getenv("FALLBACK_ON_EMPTY", "true").lower() == "true"
     RUN_JOB_ON_STARTUP = os.getenv("RUN_JOB_ON_STARTUP", "False").lower() == "true"
+    # 舊名稱 RECORD_GROUP_HISTORY_ALL 仍可使用
+    RECORD_ALL_MESSAGES = os.getenv("RECORD_ALL_MESSAGES", os.getenv("RECORD_GROUP_HISTORY_ALL", "false")).lower() == "true"
+    FAST_PARSE = os.getenv("FAST_PARSE", "false").lower() in ("1", "true")
     PORT = int(os.environ.get("PORT", 5000))
     
     # --- Constants & File Paths ---
@@ -95,13 +113,80 @@ class Config:
     USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/125.0.0.0 Safari/537.36'
     NEWS_CACHE_FILE = "news_cache.json"
     NEWS_SUMMARY_CACHE_SECONDS = 3600 * 4
+    NEWS_CACHE_MIN_TTL_SECONDS = 1800
+    NEWS_CACHE_MAX_TTL_SECONDS = 3600 * 24
+    NEWS_CACHE_HOT_HITS_PER_HOUR = 4
+    NEWS_PUSH_HOURS = (9, 16)
+    NEWS_INFLIGHT_WAIT_SECONDS = 600
+    NEWS_CACHE_MAX_ENTRIES = 128
+    RSS_CACHE_FILE = "rss_cache.json"
+    ARTICLE_CACHE_FILE = "article_cache.json"
+    ARTICLE_CACHE_SECONDS = 3600 * 24
+    ARTICLE_CACHE_MAX_ENTRIES = 1000
+    ARTICLE_LIST_CACHE_SECONDS = 300
+    JSON_FLUSH_INTERVAL_SEC = 2.0
+    JSON_COMPACT_INTERVAL_SEC = 60
     USER_PROFILE_CACHE_SECONDS = 7200
+    USER_PROFILE_CACHE_MAX_ENTRIES = 10000
+    LINE_MAX_MESSAGES_PER_REQUEST = 5
+    WEBHOOK_MAX_WORKERS = 8
+    NEWS_MAX_PENDING_REQUESTS = 16
+    SELENIUM_POOL_SIZE = int(os.getenv("SELENIUM_POOL_SIZE", "4"))
+    SELENIUM_DRIVER_MAX_USES = 50
 
 # --- 全域變化與常數 (References to Config for backward compatibility within this script if needed, 
 # but we will replace usages) ---
 
-# --- 用戶個人資料快取 (in-memory) ---
-USER_PROFILE_CACHE = {}
+# --- 用戶個人資料快取 (in-memory, LRU + TTL) ---
+# 依最近使用順序排列，超過 USER_PROFILE_CACHE_MAX_ENTRIES 時淘汰最久未使用的項目
+USER_PROFILE_CACHE = OrderedDict()
+USER_PROFILE_CACHE_LOCK = threading.Lock()
+
+# --- HTTP 連線池 ---
+# 依目標服務各自建立一個 Session，重複使用 TCP/TLS 連線，避免每次請求都重新握手。
+def _build_http_session(headers=None, pool_maxsize=10):
+    retry = Retry(total=2, backoff_factor=0.3, status_forcelist=[429, 500, 502, 503, 504])
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_maxsize, max_retries=retry)
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    if headers:
+        session.headers.update(headers)
+    return session
+
+LINE_SESSION = _build_http_session(headers={"Authorization": f"Bearer {Config.LINE_CHANNEL_ACCESS_TOKEN}"})
+# reply/push 的 JSON 請求內容以 orjson 序列化後用 data= 送出，需自行帶上 Content-Type
+LINE_JSON_HEADERS = {"Content-Type": "application/json"}
+OPENAI_SESSION = _build_http_session()
+NEWS_SESSION = _build_http_session(headers={"User-Agent": Config.USER_AGENT}, pool_maxsize=Config.NEWS_FETCH_MAX_WORKERS * 2)
+
+# --- 速率限制 ---
+class TokenBucket:
+    """執行緒安全的 token bucket：每秒補充 rate 個 token，最多累積 capacity 個；rate <= 0 表示不限速。"""
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """取得一個 token，不足時阻塞到補充完成。"""
+        if self.rate <= 0:
+            return
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+# 所有 LLM 請求共用同一個 bucket，依供應商每分鐘請求上限調整 LLM_REQUESTS_PER_MINUTE (設為 0 表示不限速)
+LLM_RATE_LIMITER = TokenBucket(rate=Config.LLM_REQUESTS_PER_MINUTE / 60, capacity=max(1, Config.LLM_CONCURRENCY))
 
 # --- 兩階段摘要的 LLM Prompt 設定 ---
 PROMPT_FOR_INDIVIDUAL_SUMMARY = (
@@ -109,9 +194,9 @@ PROMPT_FOR_INDIVIDUAL_SUMMARY = (
     "摘要應包含最關鍵的人物、事件、數據和結論。請直接輸出摘要內容，不要有任何開頭或結尾的客套話。"
 )
 
-current_date = datetime.now().strftime("%Y-%m-%d %H:%M")
+# {today} 於每次彙整時才填入，避免長時間執行的伺服器一直使用啟動當下的日期
 PROMPT_FOR_FINAL_AGGREGATION = (
-    f"今天日期是 {current_date}。\n"
+    "今天日期是 {today}。\n"
     "你是一位風趣幽默、知識淵博的新聞 Podcast 主持人。你的聽眾是 Line 用戶，他們喜歡輕鬆、易懂且帶有 Emoji 的內容。"
     "接下來我會提供數則「附有發布日期的精簡新聞摘要」。請你根據這些摘要，發揮你的主持風格，將它們整合成一篇連貫的談話性內容。"
     "你的任務是：\n"
@@ -125,6 +210,9 @@ PROMPT_FOR_FINAL_AGGREGATION = (
     "7. 總結的回答字數限制在500字以下以符合通訊軟體的限制。\n"
 )
 
+def build_final_aggregation_prompt():
+    return PROMPT_FOR_FINAL_AGGREGATION.format(today=datetime.now().strftime("%Y-%m-%d %H:%M"))
+
 # --- 機器人指令幫助訊息 ---
 HELP_MESSAGE = f"""
 哈囉！👋 我是你的 AI 助理！
@@ -148,13 +236,13 @@ HELP_MESSAGE = f"""
 💬【隨意聊天】
 除了新聞，也可以隨時用 `{Config.BOT_TRIGGER_WORD}` 問我任何問題喔！
 範例：`{Config.BOT_TRIGGER_WORD} 幫我規劃一下週末行程`
-"""
+""".strip()
 
 # ==============================================================================
 # --- 新聞擷取模組 (v5_2 Refactored) ---
 # ==============================================================================
 newspaper_config = Config()
-newspaper_config.browser_user_agent = USER_AGENT
+newspaper_config.browser_user_agent = Config.USER_AGENT
 newspaper_config.request_timeout = 15
 newspaper_config.memoize_articles = False
 
@@ -173,17 +261,105 @@ chrome_options.add_experimental_option("prefs", {
     "profile.managed_default_content_settings.images": 2, # 不載入圖片
 })
 
+# --- Selenium Driver 池 ---
+# 瀏覽器實例在多次抓取任務之間重複使用，且只在真的需要 Selenium 備援時才啟動。
+# 池中每個位置一開始是 (None, 0)，第一次被借用時才建立 driver；
+# driver 使用 SELENIUM_DRIVER_MAX_USES 次或重置失敗後會被關閉，位置還給池子重新建立，避免 Chrome 長時間執行累積記憶體。
+_DRIVER_POOL = queue.LifoQueue()
+for _ in range(Config.SELENIUM_POOL_SIZE):
+    _DRIVER_POOL.put((None, 0))
+
+# 只需要頁面的 HTML 與文字，字型、樣式表與廣告追蹤腳本一律在 Chrome 網路層攔截，不必下載
+_SELENIUM_BLOCKED_URL_PATTERNS = [
+    "*.woff", "*.woff2", "*.ttf", "*.otf", "*.css",
+    "*googletagmanager*", "*google-analytics*", "*doubleclick*", "*googlesyndication*",
+    "*facebook.net*", "*hotjar*", "*criteo*",
+]
+
+def _create_driver():
+    driver = webdriver.Chrome(options=chrome_options)
+    driver.set_page_load_timeout(60)
+    driver.set_script_timeout(60)
+    try:
+        driver.execute_cdp_cmd("Network.enable", {})
+        driver.execute_cdp_cmd("Network.setBlockedURLs", {"urls": _SELENIUM_BLOCKED_URL_PATTERNS})
+    except WebDriverException as e:
+        logging.warning(f"Selenium driver 池：無法設定網路層攔截規則，將載入完整頁面: {e}")
+    return driver
+
+def _quit_driver(driver):
+    try:
+        driver.quit()
+    except Exception:
+        pass
+
+def _reset_driver(driver):
+    """清掉 cookies 並回到空白頁，讓下一個使用者拿到乾淨的瀏覽器狀態。"""
+    try:
+        driver.delete_all_cookies()
+        driver.get("about:blank")
+        return True
+    except Exception:
+        return False
+
+@contextmanager
+def lease_driver():
+    """從池中借用一個 Selenium driver，用完自動歸還。"""
+    driver, uses = _DRIVER_POOL.get()
+    if driver is None:
+        try:
+            logging.info("Selenium driver 池：啟動新的瀏覽器實例。")
+            driver = _create_driver()
+        except Exception:
+            _DRIVER_POOL.put((None, 0))
+            raise
+    try:
+        yield driver
+    finally:
+        uses += 1
+        if uses < Config.SELENIUM_DRIVER_MAX_USES and _reset_driver(driver):
+            _DRIVER_POOL.put((driver, uses))
+        else:
+            logging.info(f"Selenium driver 池：回收已使用 {uses} 次的瀏覽器實例。")
+            _quit_driver(driver)
+            _DRIVER_POOL.put((None, 0))
+
+def shutdown_driver_pool():
+    while True:
+        try:
+            driver, _ = _DRIVER_POOL.get_nowait()
+        except queue.Empty:
+            break
+        if driver is not None:
+            _quit_driver(driver)
+
+atexit.register(shutdown_driver_pool)
+
 # --- Selenium Helper Functions ---
 
 def _dom_is_stable(driver, min_text_len=500, settle_checks=3, interval=0.6, overall_timeout=20):
     """
     回傳 True 當 DOM 文字長度穩定（連續 settle_checks 次幾乎不再成長），
     並且長度超過 min_text_len。避免在 SPA/React 還在掛載時就讀空白。
+    DOM 已解析 (readyState 不是 loading) 且內文已足夠時直接回傳，不進入輪詢。
     """
-    t0 = time.time()
+    t0 = time.monotonic()
+    # page_load_strategy 為 eager，廣告等第三方資源可能讓 readyState 遲遲不到 complete，
+    # 因此等待條件只看 DOM 是否解析完成與內文長度，並只用掉一半的時間預算
+    try:
+        WebDriverWait(driver, overall_timeout / 2, poll_frequency=interval).until(lambda d: d.execute_script(
+            "return document.readyState !== 'loading' && !!document.body && (document.body.innerText || '').length >= arguments[0];",
+            min_text_len))
+        return True
+    except (TimeoutException, WebDriverException):
+        pass
+
+    # 內文仍不足 (多半是 SPA 還在載入資料)，改為輪詢直到長度穩定
     last_len = -1
     stable = 0
-    while time.time() - t0 < overall_timeout:
+    # 輪詢至少保留足夠完成 settle_checks 次比對的時間，不受前面等待的耗時影響
+    deadline = max(t0 + overall_timeout, time.monotonic() + (settle_checks + 1) * interval)
+    while time.monotonic() < deadline:
         try:
             txt_len = driver.execute_script("return (document.body && document.body.innerText) ? document.body.innerText.length : 0;")
         except WebDriverException:
@@ -204,6 +380,16 @@ def _get_outer_html(driver):
     except WebDriverException:
         return ""
 
+def _snapshot_page(driver):
+    """一次 execute_script 同時取回 outerHTML 與內文長度，省下一次 WebDriver 往返。"""
+    try:
+        html, text_len = driver.execute_script(
+            "return [document.documentElement ? document.documentElement.outerHTML : '',"
+            " (document.body && document.body.innerText) ? document.body.innerText.length : 0];")
+        return html or "", text_len or 0
+    except WebDriverException:
+        return "", 0
+
 def _try_all_iframes_html(driver, max_frames=10):
     """
     有些新聞站把正文放在 iframe。這裡會把所有 iframe outerHTML 拼起來。
@@ -247,20 +433,14 @@ def _get_page_html_with_driver(driver: webdriver.Chrome, url: str, min_text_len:
         # 即使超時，我們還是嘗試抓取內容
 
     try:
-        driver.execute_script("window.scrollTo(0, 600);")
-        time.sleep(0.2)
-        driver.execute_script("window.scrollTo(0, 0);")
+        # 往下捲動觸發延遲載入，200ms 後由瀏覽器自行捲回頂端，只需一次往返
+        driver.execute_script("window.scrollTo(0, 600); setTimeout(function () { window.scrollTo(0, 0); }, 200);")
     except Exception:
         pass
 
     _ = _dom_is_stable(driver, min_text_len=min_text_len, settle_checks=3, interval=0.6, overall_timeout=25)
 
-    html = _get_outer_html(driver)
-    text_len = 0
-    try:
-        text_len = driver.execute_script("return (document.body && document.body.innerText) ? document.body.innerText.length : 0;")
-    except Exception:
-        pass
+    html, text_len = _snapshot_page(driver)
 
     if text_len < min_text_len:
         logging.info(f"    [Selenium] Page text length ({text_len}) is short, trying to extract from iframes.")
@@ -272,11 +452,69 @@ def _get_page_html_with_driver(driver: webdriver.Chrome, url: str, min_text_len:
     return html or ""
 
 
+# Google News RSS 連結中的文章 ID，例如 /rss/articles/CBMi...
+_GOOGLE_NEWS_ARTICLE_RE = re.compile(r"/(?:rss/)?articles/([A-Za-z0-9_-]+)")
+
+def _read_varint(buf, pos):
+    result = shift = 0
+    while True:
+        b = buf[pos]
+        pos += 1
+        result |= (b & 0x7F) << shift
+        if not b & 0x80:
+            return result, pos
+        shift += 7
+
+def _decode_google_news_url(google_news_url):
+    """
+    不發出任何請求，直接從 Google News 連結解出原始新聞網址。
+    舊格式的文章 ID 是 base64url 編碼的 protobuf，其中一個字串欄位就是原始網址；
+    新格式 (AU_yqL...) 需要 Google 伺服器解碼，這裡回傳 None 交給 HTTP 轉址處理。
+    """
+    pu = urlparse(google_news_url)
+    if not pu.netloc.endswith("news.google.com"):
+        return None
+    qs = parse_qs(pu.query)
+    if qs.get("url"):
+        return unquote(qs["url"][0])
+    m = _GOOGLE_NEWS_ARTICLE_RE.search(pu.path)
+    if not m:
+        return None
+    encoded = m.group(1)
+    try:
+        raw = base64.urlsafe_b64decode(encoded + "=" * (-len(encoded) % 4))
+        pos = 0
+        while pos < len(raw):
+            tag, pos = _read_varint(raw, pos)
+            wire_type = tag & 0x07
+            if wire_type == 0:
+                _, pos = _read_varint(raw, pos)
+            elif wire_type == 2:
+                length, pos = _read_varint(raw, pos)
+                field = raw[pos:pos + length]
+                pos += length
+                if field.startswith((b"http://", b"https://")):
+                    url = field.decode("utf-8")
+                    return None if url.startswith("https://news.google.com/") else url
+            else:
+                return None
+    except (ValueError, IndexError, UnicodeDecodeError):
+        return None
+    return None
+
 def get_real_url(google_news_url):
+    decoded_url = _decode_google_news_url(google_news_url)
+    if decoded_url:
+        return decoded_url
     try:
-        headers = {"User-Agent": USER_AGENT}
-        with requests.get(google_news_url, headers=headers, allow_redirects=True, timeout=20, stream=True) as r:
-            return r.url
+        # 只需要跳轉後的最終網址，用 HEAD 避免下載頁面內容
+        r = NEWS_SESSION.head(google_news_url, allow_redirects=True, timeout=20)
+        if r.status_code == 405:
+            # 不支援 HEAD 的伺服器改用只取第一個位元組的 GET
+            with NEWS_SESSION.get(google_news_url, allow_redirects=True, timeout=20,
+                                  stream=True, headers={"Range": "bytes=0-0"}) as r:
+                return r.url
+        return r.url
     except requests.RequestException as e:
         logging.warning(f"[錯誤] 解析跳轉連結失敗 {google_news_url}: {e}")
         # 如果請求失敗，嘗試從 URL 參數解析
@@ -290,138 +528,315 @@ def get_real_url(google_news_url):
             pass
         return google_news_url # 返回原始 URL 作為備援
 
-def fetch_and_parse_articles(custom_query=None, limit=NEWS_FETCH_TARGET_COUNT):
+def download_article_html(url):
+    """
+    透過共用的 NEWS_SESSION 下載文章 HTML，取代 newspaper3k 內部各自建立的連線。
+    失敗時回傳 None。
+    """
+    try:
+        resp = NEWS_SESSION.get(url, timeout=15)
+        resp.raise_for_status()
+    except requests.RequestException as e:
+        logging.warning(f"  [執行緒] 下載文章失敗 {url}: {e}")
+        return None
+    # 未宣告 charset 時 requests 會預設 ISO-8859-1，改用內容推測的編碼避免中文亂碼
+    if not resp.encoding or resp.encoding.lower() == 'iso-8859-1':
+        resp.encoding = resp.apparent_encoding
+    return resp.text
+
+# 常見新聞網站的正文容器；FAST_PARSE 開啟時先以 lxml 直接擷取，抓不到足夠內文再交給 newspaper3k
+_FAST_PARSE_BODY_XPATH = (
+    "//article"
+    " | //*[@itemprop='articleBody']"
+    " | //div[contains(concat(' ', normalize-space(@class), ' '), ' article-body ')]"
+    " | //div[contains(concat(' ', normalize-space(@class), ' '), ' entry-content ')]"
+    " | //div[contains(concat(' ', normalize-space(@class), ' '), ' post-content ')]"
+)
+
+def fast_extract_article(html):
+    """
+    以 lxml (libxml2) 解析 HTML，從正文容器擷取標題與內文。
+    找不到正文容器或解析失敗時回傳 None。
+    """
+    try:
+        tree = lxml.html.fromstring(html)
+    except (ValueError, lxml.etree.ParserError):
+        return None
+    for node in tree.xpath("//script | //style | //noscript"):
+        node.drop_tree()
+
+    best_text = ""
+    for container in tree.xpath(_FAST_PARSE_BODY_XPATH):
+        paragraphs = [p.text_content().strip() for p in container.iter("p")]
+        text = "\n\n".join(p for p in paragraphs if p) or container.text_content().strip()
+        if len(text) > len(best_text):
+            best_text = text
+    if not best_text:
+        return None
+
+    title = tree.xpath("string(//meta[@property='og:title']/@content)").strip() or tree.findtext(".//title", "").strip()
+    return title, best_text
+
+def _rss_entry_to_dict(entry):
+    """把 feedparser 條目精簡成可存成 JSON 的 dict，只保留後續流程需要的欄位。"""
+    published_ts = None
+    if entry.get('published_parsed'):
+        # published_parsed 是 UTC 的 time.struct_time
+        published_ts = calendar.timegm(entry.published_parsed)
+    source = entry.get('source') or {}
+    return {
+        'title': entry.get('title', ''),
+        'link': entry.get('link', ''),
+        'source': source.get('title') or "未知來源",
+        'published_ts': published_ts,
+    }
+
+def fetch_rss_entries(rss_url):
+    """
+    透過共用的 NEWS_SESSION 以 ETag / Last-Modified 發出條件式請求取得 RSS 條目。
+    伺服器回應 304 Not Modified 時直接沿用上次的條目；下載或解析失敗時回傳 None。
+    """
+    with RSS_CACHE_LOCK:
+        cached = RSS_CACHE.get(rss_url) or {}
+    conditional_headers = {}
+    if cached.get("entries"):
+        if cached.get("etag"):
+            conditional_headers["If-None-Match"] = cached["etag"]
+        if cached.get("modified"):
+            conditional_headers["If-Modified-Since"] = cached["modified"]
+    try:
+        resp = NEWS_SESSION.get(rss_url, headers=conditional_headers, timeout=15)
+        if resp.status_code == 304:
+            logging.info("RSS feed 未變更 (304)，沿用上次取得的條目。")
+            return cached["entries"]
+        resp.raise_for_status()
+    except requests.RequestException as e:
+        logging.error(f"下載 RSS feed 失敗: {e}")
+        return None
+
+    # 交給 feedparser 的是已下載的內容，它不會再自行建立連線
+    feed = feedparser.parse(resp.content)
+    if feed.bozo:
+        logging.error(f"無法解析 RSS feed。錯誤資訊: {feed.bozo_exception}")
+        return None
+
+    entries = [_rss_entry_to_dict(e) for e in feed.entries]
+    with RSS_CACHE_LOCK:
+        # 重新插入讓最近使用的查詢排在最後，超過上限時從最舊的開始移除
+        RSS_CACHE.pop(rss_url, None)
+        RSS_CACHE[rss_url] = {"etag": resp.headers.get("ETag"), "modified": resp.headers.get("Last-Modified"), "entries": entries}
+        while len(RSS_CACHE) > Config.NEWS_CACHE_MAX_ENTRIES:
+            RSS_CACHE.popitem(last=False)
+    schedule_json_save(RSS_CACHE, Config.RSS_CACHE_FILE)
+    return entries
+
+def get_cached_article(link):
+    """以 RSS 條目連結查詢先前抓過的文章 (真實 URL、標題、內文、發布時間)，過期或不存在時回傳 None。"""
+    with ARTICLE_CACHE_LOCK:
+        item = ARTICLE_CACHE.get(link)
+        if item and time.time() - item['fetched_at'] < Config.ARTICLE_CACHE_SECONDS:
+            return item
+        return None
+
+def cache_article(link, item):
+    item['fetched_at'] = time.time()
+    with ARTICLE_CACHE_LOCK:
+        # 重新插入讓最新抓取的文章排在最後，超過上限時從最舊的開始移除
+        ARTICLE_CACHE.pop(link, None)
+        ARTICLE_CACHE[link] = item
+        while len(ARTICLE_CACHE) > Config.ARTICLE_CACHE_MAX_ENTRIES:
+            ARTICLE_CACHE.pop(next(iter(ARTICLE_CACHE)))
+    schedule_json_save(ARTICLE_CACHE, Config.ARTICLE_CACHE_FILE)
+
+def iter_fetched_articles(custom_query=None, limit=Config.NEWS_FETCH_TARGET_COUNT):
     """
-    *** v5_2 版本：採用循序執行，重複使用單一 Selenium 實例來加速 ***
+    轉址解析與文章下載屬於 I/O 密集工作，交由執行緒池平行處理；
+    只有內文過短的文章才會借用 driver 池中的 Selenium 實例進行備援渲染。
+    每篇文章一完成擷取並通過日期過濾就立即 yield (依完成順序)，呼叫端可以邊抓取邊處理。
     """
-    query_to_use = custom_query.strip() if custom_query and custom_query.strip() else DEFAULT_NEWS_KEYWORDS
+    query_to_use = custom_query.strip() if custom_query and custom_query.strip() else Config.DEFAULT_NEWS_KEYWORDS
     encoded_query = urllib.parse.quote_plus(query_to_use)
     rss_url = f"https://news.google.com/rss/search?q={encoded_query}&hl=zh-TW&gl=TW&ceid=TW:zh-Hant"
     
     logging.info(f">>> 開始從 Google News RSS 取得新聞列表 (關鍵字: '{query_to_use}')")
-    feed = feedparser.parse(rss_url)
-
-    if feed.bozo:
-        logging.error(f"無法解析 RSS feed。錯誤資訊: {feed.bozo_exception}")
-        return []
+    entries = fetch_rss_entries(rss_url)
+    if entries is None:
+        return
 
-    successful_articles = []
+    # 可以將天數設定為環境變數，例如 3 天
+    days_limit = int(os.getenv("NEWS_FETCH_DAYS_LIMIT", "3"))
+    time_threshold = datetime.now().astimezone() - timedelta(days=days_limit)
+    successful_count = 0
+    recent_count = 0
     processed_urls = set()
-    entries_to_process = feed.entries[:limit * 2]
+    processed_urls_lock = threading.Lock()
+    # 達到目標數量後設定，讓仍在執行中的工作在下一個耗時步驟前提早結束
+    stop_event = threading.Event()
+    entries_to_process = entries[:limit * 2]
+
+    # 內部輔助函式，處理單一 RSS 條目的完整抓取流程 (在執行緒池中執行)
+    def _process_single_entry(entry):
+        if stop_event.is_set():
+            return None
+        logging.info(f"  [執行緒] 開始處理: {entry['title']}")
+        # 關鍵字重疊時同一篇報導常在不同次抓取中重複出現，命中快取即可略過轉址解析、下載與 Selenium 渲染
+        cached = get_cached_article(entry['link'])
+        real_url = cached['url'] if cached else get_real_url(entry['link'])
+        with processed_urls_lock:
+            if not real_url or real_url in processed_urls:
+                logging.warning(f"  [執行緒] 跳過: 無法取得真實 URL 或 URL 重複 for {entry['title']}")
+                return None
+            processed_urls.add(real_url)
+
+        if cached:
+            logging.info(f"  [執行緒] 使用文章快取: {cached['title']}")
+            title, text, publish_ts = cached['title'], cached['text'], cached['publish_ts']
+        else:
+            if stop_event.is_set():
+                return None
+            html = download_article_html(real_url)
+            if not html:
+                return None
+            fast_result = fast_extract_article(html) if Config.FAST_PARSE else None
+            if fast_result and fast_result[0] and len(fast_result[1]) > 200:
+                title, text = fast_result
+                parsed_publish_date = None
+            else:
+                article = Article(real_url, language='zh', config=newspaper_config)
+                article.download(input_html=html)
+                article.parse()
+
+                if len(article.text) < 200:
+                    if stop_event.is_set():
+                        return None
+                    logging.warning(f"  [執行緒] 內容過短，為 '{entry['title']}' 啟用 Selenium 備援抓取。")
+                    with lease_driver() as driver:
+                        html_content = _get_page_html_with_driver(driver, real_url)
+                    if html_content:
+                        article.download(input_html=html_content)
+                        article.parse()
+                title, text, parsed_publish_date = article.title, article.text, article.publish_date
+
+            if not (title and len(text) > 50):
+                logging.warning(f"  [執行緒] 失敗: 無法為 {entry['title']} 解析足夠內文。")
+                return None
+
+            # 優先使用 newspaper3k 從網頁解析的日期，通常更準確；網頁上沒有日期時使用 RSS feed 的 pubDate 作為備援
+            publish_ts = parsed_publish_date.timestamp() if parsed_publish_date else entry['published_ts']
+            cache_article(entry['link'], {'url': real_url, 'title': title, 'text': text, 'publish_ts': publish_ts})
+
+        # 發布時間以 UTC timestamp 保存，轉換為帶有本地時區的 datetime 物件
+        publish_date = datetime.fromtimestamp(publish_ts, tz=timezone.utc).astimezone() if publish_ts else None
+
+        logging.info(f"  [執行緒] 成功取得: {title} (發布於: {publish_date.strftime('%Y-%m-%d %H:%M') if publish_date else '未知'})")
+        return {
+            'title': title,
+            'text': text,
+            'url': real_url,
+            'source': entry['source'],
+            'publish_date': publish_date  # 將日期物件儲存起來
+        }
 
-    # --- 循序處理核心 ---
-    # 在所有任務開始前，只啟動一次瀏覽器。
-    # 使用 "with" 陳述式確保瀏覽器在區塊結束後一定會被關閉。
-    logging.info("初始化單一瀏覽器實例以供本次任務重複使用...")
+    # --- 平行處理核心 ---
+    max_workers = max(1, min(Config.NEWS_FETCH_MAX_WORKERS, len(entries_to_process)))
+    logging.info(f"啟動 ThreadPoolExecutor 處理 {len(entries_to_process)} 個新聞條目，最大平行度: {max_workers}")
+    executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="news-fetch")
     try:
-        with webdriver.Chrome(options=chrome_options) as driver:
-            driver.set_page_load_timeout(60)
-            driver.set_script_timeout(60)
-            logging.info("瀏覽器實例已啟動，開始循序處理新聞條目。")
-            
-            for i, entry in enumerate(entries_to_process):
-                if len(successful_articles) >= limit:
-                    logging.info("已達到目標新聞數量，提前結束抓取。")
+        future_to_entry = {executor.submit(_process_single_entry, entry): entry for entry in entries_to_process}
+        for future in as_completed(future_to_entry):
+            entry = future_to_entry[future]
+            try:
+                result = future.result()
+            except Exception as e:
+                logging.error(f"  處理 {entry['title']} 時發生未預期錯誤: {e}", exc_info=False) # exc_info=False 避免過多日誌
+                continue
+            if result:
+                successful_count += 1
+                # 過濾掉沒有日期或太舊的文章
+                if result.get('publish_date') and result['publish_date'] > time_threshold:
+                    recent_count += 1
+                    yield result
+                if successful_count >= limit:
+                    logging.info("已達到目標新聞數量，提前結束抓取，取消其餘工作。")
                     break
-
-                logging.info(f"  [循序處理 {i+1}/{len(entries_to_process)}] 開始處理: {entry.title}")
-                real_url = get_real_url(entry.link)
-                if not real_url or real_url in processed_urls:
-                    logging.warning(f"  跳過: 無法取得真實 URL 或 URL 重複 for {entry.title}")
-                    continue
-                
-                try:
-                    article = Article(real_url, language='zh', config=newspaper_config)
-                    article.download()
-                    article.parse()
-                    
-                    if len(article.text) < 200:
-                        logging.warning(f"  內容過短，為 '{entry.title}' 啟用 Selenium 備援抓取。")
-                        html_content = _get_page_html_with_driver(driver, real_url)
-                        if html_content:
-                            article.download(input_html=html_content)
-                            article.parse()
-
-                    if article.title and len(article.text) > 50:
-                        publish_date = None
-                        # 優先使用 newspaper3k 從網頁解析的日期，通常更準確
-                        if hasattr(article, 'publish_date') and article.publish_date:
-                            publish_date = article.publish_date.astimezone() # 轉換為帶有本地時區的 datetime 物件
-                        # 如果網頁上沒有日期，使用 RSS feed 的 pubDate 作為備援
-                        elif hasattr(entry, 'published_parsed') and entry.published_parsed:
-                            # entry.published_parsed 是 time.struct_time，需要轉換
-                            # 注意：原始時間是 GMT，我們需要處理時區
-                            dt_gmt = datetime.fromtimestamp(time.mktime(entry.published_parsed), tz=timezone.utc)
-                            publish_date = dt_gmt.astimezone() # 轉換為本地時區
-                            
-                        logging.info(f"  成功取得: {article.title} (發布於: {publish_date.strftime('%Y-%m-%d %H:%M') if publish_date else '未知'})")
-                        successful_articles.append({
-                            'title': article.title,
-                            'text': article.text,
-                            'url': real_url,
-                            'source': entry.source.title if hasattr(entry, 'source') and hasattr(entry.source, 'title') else "未知來源",
-                            'publish_date': publish_date  # 將日期物件儲存起來
-                        })
-                        processed_urls.add(real_url)
-                    else:
-                        logging.warning(f"  失敗: 無法為 {entry.title} 解析足夠內文。")
-                except Exception as e:
-                    logging.error(f"  處理 {entry.title} 時發生未預期錯誤: {e}", exc_info=False) # exc_info=False 避免過多日誌
-
-    except WebDriverException as e:
-        logging.critical(f"WebDriver 實例啟動或執行時發生嚴重錯誤，本次抓取中止: {e}", exc_info=True)
-        # 如果 driver 啟動失敗，回傳空列表
-        return []
-
-    logging.info(f">>> 循序新聞內文擷取完成，共成功取得 {len(successful_articles)} 篇。")
-    # --- 新增的過濾與排序邏輯 ---
-    if successful_articles:
-        now = datetime.now().astimezone()
-        # 可以將天數設定為環境變數，例如 3 天
-        days_limit = int(os.getenv("NEWS_FETCH_DAYS_LIMIT", "3"))
-        time_threshold = now - timedelta(days=days_limit)
-        
-        original_count = len(successful_articles)
-        
-        # 1. 過濾掉沒有日期或太舊的文章
-        successful_articles = [
-            art for art in successful_articles 
-            if art.get('publish_date') and art['publish_date'] > time_threshold
-        ]
-        
-        # 2. 根據發布日期由新到舊排序
-        successful_articles.sort(key=lambda x: x.get('publish_date'), reverse=True)
-        
-        filtered_count = len(successful_articles)
-        logging.info(f"日期過濾完成: 從 {original_count} 篇篩選出 {filtered_count} 篇近 {days_limit} 天內的新聞。")
-        
-    return successful_articles[:limit]
+    finally:
+        # 取消尚未開始的工作；執行中的工作會在 stop_event 檢查點自行結束，不必等待
+        stop_event.set()
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    logging.info(f">>> 新聞內文擷取完成，共成功取得 {successful_count} 篇。")
+    if successful_count:
+        logging.info(f"日期過濾完成: 從 {successful_count} 篇篩選出 {recent_count} 篇近 {days_limit} 天內的新聞。")
+
+def fetch_and_parse_articles(custom_query=None, limit=Config.NEWS_FETCH_TARGET_COUNT):
+    """抓取完所有文章後一次回傳，依發布日期由新到舊排序。"""
+    articles = list(iter_fetched_articles(custom_query=custom_query, limit=limit))
+    articles.sort(key=lambda x: x['publish_date'], reverse=True)
+    return articles
+
+# --- 文章清單短期快取 ---
+# 以 (正規化關鍵字, limit) 為 key 保存抓取到的文章清單 ARTICLE_LIST_CACHE_SECONDS 秒。
+# 同一個 key 的並行請求已由 _NEWS_INFLIGHT 合併，這裡只負責讓 LLM 失敗後的重試不必重新抓取文章。
+_ARTICLE_LIST_CACHE = {}
+_ARTICLE_LIST_CACHE_LOCK = threading.Lock()
+
+def iter_articles_cached(custom_query=None, limit=Config.NEWS_FETCH_TARGET_COUNT):
+    """快取命中時逐一 yield 快取的文章，否則邊抓取邊 yield，全部取完後再寫入快取。"""
+    key = (news_cache_key(custom_query), limit)
+    with _ARTICLE_LIST_CACHE_LOCK:
+        cached = _ARTICLE_LIST_CACHE.get(key)
+    if cached and time.time() - cached[0] < Config.ARTICLE_LIST_CACHE_SECONDS:
+        logging.info(f"文章清單快取命中 (關鍵字: '{key[0]}')，略過重新抓取。")
+        yield from list(cached[1])
+        return
+    articles = []
+    for article in iter_fetched_articles(custom_query=custom_query, limit=limit):
+        articles.append(article)
+        yield article
+    articles.sort(key=lambda x: x['publish_date'], reverse=True)
+    now = time.time()
+    with _ARTICLE_LIST_CACHE_LOCK:
+        for k in [k for k, (ts, _) in _ARTICLE_LIST_CACHE.items() if now - ts >= Config.ARTICLE_LIST_CACHE_SECONDS]:
+            del _ARTICLE_LIST_CACHE[k]
+        # 抓取失敗 (空清單) 不快取，下一次請求會重新嘗試
+        if articles:
+            _ARTICLE_LIST_CACHE[key] = (now, articles)
+
+def _collect_into(sink, iterable):
+    """逐一轉交 iterable 的項目，同時記錄到 sink 清單中。"""
+    for item in iterable:
+        sink.append(item)
+        yield item
+
+# content 為 parts 清單時，每個 part 可能存放文字的欄位 (依序嘗試)
+_CONTENT_PART_KEYS = ("text", "output_text", "data", "value")
+
+def _join_content_parts(parts: list) -> str:
+    return "".join(
+        p if isinstance(p, str) else next((p[k] for k in _CONTENT_PART_KEYS if p.get(k)), "")
+        for p in parts if isinstance(p, (str, dict))
+    ).strip()
 
 def _extract_assistant_text_from_response(resp_json: dict) -> str:
-    if not resp_json or "choices" not in resp_json or not resp_json["choices"]:
+    choices = (resp_json or {}).get("choices")
+    if not choices:
         return ""
-    ch0 = resp_json["choices"][0]
-    msg = ch0.get("message", {}) or {}
+    ch0 = choices[0]
+    msg = ch0.get("message") or {}
 
     # 1) content 可能是字串或 parts
     content = msg.get("content")
-    if isinstance(content, str) and content.strip():
-        return content.strip()
-    if isinstance(content, list):
-        parts = []
-        for p in content:
-            if isinstance(p, str):
-                parts.append(p)
-            elif isinstance(p, dict):
-                txt = p.get("text") or p.get("output_text") or p.get("data") or p.get("value") or ""
-                if txt: parts.append(txt)
-        if parts:
-            return "".join(parts).strip()
+    if isinstance(content, str):
+        if (text := content.strip()):
+            return text
+    elif isinstance(content, list):
+        if (text := _join_content_parts(content)):
+            return text
 
     # 2) 兼容舊的 choices[0].text
     legacy = ch0.get("text")
-    if isinstance(legacy, str) and legacy.strip():
-        return legacy.strip()
+    if isinstance(legacy, str) and (text := legacy.strip()):
+        return text
 
     # 3) content 不可用 → 試著從 reasoning_content 的 Draft 抽
     rc = msg.get("reasoning_content")
@@ -430,23 +845,48 @@ def _extract_assistant_text_from_response(resp_json: dict) -> str:
         return draft
 
     # 4) 最後才看環境開關，是否整包丟回
-    if os.getenv("ALLOW_REASONING_FALLBACK", "false").lower() == "true" and isinstance(rc, str) and rc.strip():
+    if Config.ALLOW_REASONING_FALLBACK and isinstance(rc, str) and rc.strip():
         return rc.strip()
 
     return ""
 
-
-
-import re, json
-
-# 常見的 Draft 標記樣式
-_DRAFT_PATTERNS = [
+# 常見的 Draft 標記樣式 (模組載入時預先編譯)
+_DRAFT_PATTERNS = [re.compile(p, re.S) for p in (
     r'Draft[:：]\s*[\"“](.+?)[\"”]\s*$',              # Draft: "...."
     r'Draft[:：]\s*```(?:\w+)?\n(.+?)\n```',          # Draft: ``` ... ```
     r'###\s*Draft\s*\n(.+)$',                         # Markdown 標題 Draft
     r'草稿[:：]\s*(.+)$',                              # 中文「草稿:」
     r'最終稿[:：]\s*(.+)$',                            # 中文「最終稿:」
-]
+)]
+
+# Draft 後面可能接的「字數統計/Count:」
+_DRAFT_TAIL_RE = re.compile(r'\n(?:Count|字|characters)[:：]')
+
+# 看起來像完整中文句子的片段
+_SENT_RE = re.compile(r'[\u4e00-\u9fff，、；：：「」『』（）()A-Za-z0-9%\- ]+[。.!?]')
+
+# LLM 回應中的 <think>...</think> 區塊
+_THINK_RE = re.compile(r"<think>(.*?)</think>", re.DOTALL | re.IGNORECASE)
+
+_JSON_DECODER = json.JSONDecoder()
+
+def _find_json_answer(text: str) -> str:
+    """從每個 '{' 位置嘗試 raw_decode，回傳第一個含有答案欄位的 JSON 物件內容。"""
+    pos = text.find('{')
+    while pos != -1:
+        try:
+            obj, end = _JSON_DECODER.raw_decode(text, pos)
+        except ValueError:
+            pos = text.find('{', pos + 1)
+            continue
+        if isinstance(obj, dict):
+            for key in ("summary", "final", "output", "answer"):
+                value = obj.get(key)
+                if isinstance(value, str) and value.strip():
+                    return value.strip()
+        # 已完整解析的物件不必再從內部重新掃描
+        pos = text.find('{', end)
+    return ""
 
 def _extract_draft_from_reasoning(reasoning: str) -> str:
     if not reasoning:
@@ -455,26 +895,20 @@ def _extract_draft_from_reasoning(reasoning: str) -> str:
 
     # 1) 先嘗試嚴格的 Draft 標記
     for pat in _DRAFT_PATTERNS:
-        m = re.search(pat, text, flags=re.S)
+        m = pat.search(text)
         if m and m.group(1):
             draft = m.group(1).strip()
             # 去掉後面可能接的「字數統計/Count:」
-            draft = re.split(r'\n(?:Count|字|characters)[:：]', draft)[0].strip()
+            draft = _DRAFT_TAIL_RE.split(draft, maxsplit=1)[0].strip()
             return draft
 
     # 2) 有些會輸出 JSON，把 "summary" 放在 reasoning 裡
-    jm = re.search(r'\{.*\}', text, flags=re.S)
-    if jm:
-        try:
-            obj = json.loads(jm.group(0))
-            for key in ("summary", "final", "output", "answer"):
-                if isinstance(obj.get(key, ""), str) and obj[key].strip():
-                    return obj[key].strip()
-        except Exception:
-            pass
+    answer = _find_json_answer(text)
+    if answer:
+        return answer
 
     # 3) 退而求其次：抓最後一段看起來像完整中文句子的內容
-    sent = re.findall(r'[\u4e00-\u9fff，、；：：「」『』（）()A-Za-z0-9%\- ]+[。.!?]', text)
+    sent = _SENT_RE.findall(text)
     if sent:
         return sent[-1].strip()
 
@@ -483,20 +917,81 @@ def _extract_draft_from_reasoning(reasoning: str) -> str:
 # ==============================================================================
 # --- OpenAI & LLM 互動模組 ---
 # ==============================================================================
-def call_openai_api(messages, model=OPENAI_COMPLETION_MODEL, max_tokens=4000, temperature=0.7):
-    if not OPENAI_API_KEY:
+def _retry_after_seconds(response, default=5.0):
+    try:
+        return max(0.0, float(response.headers.get("Retry-After", default)))
+    except (TypeError, ValueError):
+        # Retry-After 也可能是 HTTP 日期格式，這裡直接使用預設值
+        return default
+
+def _read_streamed_completion(response):
+    """
+    逐行讀取 SSE 串流 (data: {...})，把各段 delta 串接起來，
+    並組成與非串流回應相同的結構，讓 _extract_assistant_text_from_response 可以沿用。
+    """
+    content_parts, reasoning_parts = [], []
+    for line in response.iter_lines():
+        if not line or not line.startswith(b"data:"):
+            continue
+        payload = line[5:].strip()
+        if payload == b"[DONE]":
+            break
+        try:
+            chunk = orjson.loads(payload)
+        except ValueError:
+            continue
+        if chunk.get("error"):
+            # 服務在串流途中回報錯誤時，原樣交給呼叫端處理，避免被當成空白回覆
+            return {"error": chunk["error"]}
+        for choice in chunk.get("choices") or []:
+            delta = choice.get("delta") or {}
+            if delta.get("content"):
+                content_parts.append(delta["content"])
+            if delta.get("reasoning_content"):
+                reasoning_parts.append(delta["reasoning_content"])
+    message = {"role": "assistant", "content": "".join(content_parts)}
+    if reasoning_parts:
+        message["reasoning_content"] = "".join(reasoning_parts)
+    return {"choices": [{"message": message}]}
+
+def call_openai_api(messages, model=Config.OPENAI_COMPLETION_MODEL, max_tokens=4000, temperature=0.7):
+    if not Config.OPENAI_API_KEY:
         logging.error("OPENAI_API_KEY is not set.")
         return "抱歉，API Key 未設定，無法處理您的請求。"
-    headers = {"Authorization": f"Bearer {OPENAI_API_KEY}", "Content-Type": "application/json", "ngrok-skip-browser-warning": "true"}
+    headers = {"Authorization": f"Bearer {Config.OPENAI_API_KEY}", "Content-Type": "application/json", "ngrok-skip-browser-warning": "true"}
     data = {"model": model, "messages": messages, "max_tokens": max_tokens, "temperature": temperature}
+    if Config.LLM_STREAM:
+        data["stream"] = True
+    # 請求內容只序列化一次，429 重試時直接重送同一份 bytes
+    body = orjson.dumps(data)
+    # 串流模式下 read timeout 是「兩段資料之間」的等待上限；非串流時仍需等待整段生成完成
+    timeout = (10, Config.LLM_READ_TIMEOUT_SEC if Config.LLM_STREAM else Config.LLM_TIMEOUT_SEC)
     try:
-        response = requests.post(f"{OPENAI_BASE_URL}/v1/chat/completions", headers=headers, json=data, timeout=980)
-        response.raise_for_status()
-        resp_json = response.json()
-#         logging.info(str(resp_json)) 
+        for attempt in range(2):
+            LLM_RATE_LIMITER.acquire()
+            response = OPENAI_SESSION.post(f"{Config.OPENAI_BASE_URL}/v1/chat/completions", headers=headers, data=body, timeout=timeout, stream=Config.LLM_STREAM)
+            if response.status_code != 429 or attempt:
+                break
+            # 被限流時只讓目前這個執行緒依 Retry-After 退避後重試一次
+            response.close()
+            wait = _retry_after_seconds(response)
+            logging.warning(f"OpenAI API 速率限制 (429)，{wait:.1f} 秒後重試。Model: {model}")
+            time.sleep(wait)
+        with response:
+            response.raise_for_status()
+            if "text/event-stream" in response.headers.get("Content-Type", ""):
+                resp_json = _read_streamed_completion(response)
+            else:
+                # 不支援串流的相容服務會直接回傳完整 JSON
+                resp_json = orjson.loads(response.content)
+        # 完整回應只在 DEBUG 等級輸出，%s 延遲格式化讓一般執行時不必組出大字串
+        logging.debug("OpenAI API 原始回應: %s", resp_json)
+        if resp_json.get("error"):
+            logging.error(f"OpenAI API returned error: {resp_json['error']}. Model: {model}")
+            return f"抱歉，OpenAI ({model}) 服務回傳錯誤。"
 
         content = _extract_assistant_text_from_response(resp_json)
-        if (not content or not content.strip()) and os.getenv("ALLOW_REASONING_FALLBACK", "false").lower() == "true":
+        if (not content or not content.strip()) and Config.ALLOW_REASONING_FALLBACK:
             content = str(resp_json)
         
         logging.info(f"OpenAI API 呼叫成功，模型: {model}，回應長度: {len(content)}")
@@ -507,8 +1002,11 @@ def call_openai_api(messages, model=OPENAI_COMPLETION_MODEL, max_tokens=4000, te
     except requests.exceptions.RequestException as e:
         logging.error(f"OpenAI API request error: {e}. Model: {model}")
         return f"抱歉，連接 OpenAI ({model}) 服務時發生錯誤。"
-    except (KeyError, IndexError, TypeError) as e:
-        response_text = response.text if 'response' in locals() else 'N/A'
+    except (KeyError, IndexError, TypeError, ValueError) as e:
+        try:
+            response_text = response.text if 'response' in locals() else 'N/A'
+        except RuntimeError:
+            response_text = '(串流回應已讀取完畢)'
         logging.error(f"OpenAI API response format error: {e} - Response: {response_text}")
         return f"抱歉，OpenAI ({model}) 回應格式有問題。"
     except Exception as e:
@@ -522,8 +1020,9 @@ def generate_chat_response(context_id, prompt_text):
         "請根據我們的對話歷史來回應所有問題。忽略任何外部知識或新主題，也不要根據已知記憶，只使用提供的上下文內容生成答案。"
         "如果答案需要思考步驟，請將思考過程用 <think> 和 </think> 標籤包起來。"
     )
-    context_history = CONVERSATION_HISTORY.get(context_id, [])
-    messages_for_api = [{"role": "system", "content": system_prompt}] + context_history
+    # 其他執行緒可能同時追加紀錄，先在鎖內取得快照
+    with _STORE_LOCK:
+        messages_for_api = [{"role": "system", "content": system_prompt}, *CONVERSATION_HISTORY.get(context_id, ())]
     bot_response = call_openai_api(messages_for_api)
     return bot_response
 
@@ -531,29 +1030,37 @@ def generate_chat_response(context_id, prompt_text):
 # --- 新聞摘要與整合模組 ---
 # ==============================================================================
 def summarize_news_flow(articles_data):
-    if not articles_data: return "今天沒有抓取到相關新聞可供摘要。"
+    """
+    articles_data 可以是清單或邊抓取邊產生文章的 iterator；
+    每篇文章一到就送出第一階段摘要，LLM 呼叫與其餘文章的下載重疊進行。
+    """
     logging.info("--- 開始第一階段摘要：逐篇精簡 ---")
-    individual_summaries = []
-    for i, article in enumerate(articles_data):
-        logging.info(f"  正在摘要第 {i+1}/{len(articles_data)} 篇: {article['title']}")
+
+    def _summarize_single_article(i, article):
+        logging.info(f"  正在摘要第 {i+1} 篇: {article['title']}")
         content_to_summarize = article['text'][:8000]
         user_prompt = f"新聞標題：{article['title']}\n\n新聞內文：\n{content_to_summarize}"
         raw_summary = call_openai_api([{"role": "system", "content": PROMPT_FOR_INDIVIDUAL_SUMMARY}, {"role": "user", "content": user_prompt}], model=os.getenv("OPENAI_COMPLETION_MODEL", "gpt-4o-mini"), max_tokens=3500, temperature=0.2)
         
-        logging.info(f"  user_prompt: {user_prompt}")
-        logging.info(f"  raw_summary: {raw_summary}")
+        logging.debug("  user_prompt: %s", user_prompt)
+        logging.debug("  raw_summary: %s", raw_summary)
         
         if raw_summary.startswith("抱歉，"):
             logging.warning(f"  [跳過] 第 {i+1} 篇新聞摘要失敗: {raw_summary}")
-            continue
-        think_pattern = re.compile(r"<think>.*?</think>", re.DOTALL | re.IGNORECASE)
-        cleaned_summary = re.sub(think_pattern, '', raw_summary).strip()
+            return None
+        cleaned_summary = _THINK_RE.sub('', raw_summary).strip()
         if len(raw_summary) != len(cleaned_summary): logging.info(f"  已清理掉 <think> 標籤。")
-        individual_summaries.append({'title': article['title'], 'url': article['url'], 'summary': cleaned_summary,
-            'publish_date': article.get('publish_date')})
-        logging.info(f"  摘要完成，長度: {len(cleaned_summary)} 字")
-        logging.info(f"  等待30秒 避免LLM速率限制")
-        time.sleep(30) # 降低LLM速率
+        logging.info(f"  第 {i+1} 篇摘要完成，長度: {len(cleaned_summary)} 字")
+        return {'title': article['title'], 'url': article['url'], 'summary': cleaned_summary,
+            'publish_date': article.get('publish_date')}
+
+    # 平行呼叫 LLM，速率由 LLM_RATE_LIMITER 控制；文章到達時立即提交，不必等全部抓取完成
+    with ThreadPoolExecutor(max_workers=max(1, Config.LLM_CONCURRENCY), thread_name_prefix="llm-summary") as executor:
+        pending = [(article, executor.submit(_summarize_single_article, i, article)) for i, article in enumerate(articles_data)]
+    if not pending: return "今天沒有抓取到相關新聞可供摘要。"
+    # 文章依抓取完成的順序到達，彙整前改回依發布日期由新到舊排序
+    pending.sort(key=lambda p: p[0]['publish_date'].timestamp() if p[0].get('publish_date') else float('-inf'), reverse=True)
+    individual_summaries = [item for item in (future.result() for _, future in pending) if item]
     if not individual_summaries: return "抱歉，今日新聞摘要生成過程發生問題，無法產出內容。"
     logging.info("--- 開始第二階段摘要：彙整生成 Podcast 內容 ---")
 #     summaries_for_prompt = [f"新聞 {i+1}:\n標題: {item['title']}\n摘要內容: {item['summary']}\n---" for i, item in enumerate(individual_summaries)]
@@ -569,7 +1076,7 @@ def summarize_news_flow(articles_data):
         summaries_for_prompt.append(prompt_line)
     
     final_user_prompt = "\n".join(summaries_for_prompt)
-    final_summary = call_openai_api([{"role": "system", "content": PROMPT_FOR_FINAL_AGGREGATION}, {"role": "user", "content": final_user_prompt}], model=os.getenv("OPENAI_COMPLETION_MODEL", "gpt-4o"), max_tokens=3000, temperature=0.7)
+    final_summary = call_openai_api([{"role": "system", "content": build_final_aggregation_prompt()}, {"role": "user", "content": final_user_prompt}], model=os.getenv("OPENAI_COMPLETION_MODEL", "gpt-4o"), max_tokens=3000, temperature=0.7)
     return final_summary
 
 # ==============================================================================
@@ -577,227 +1084,593 @@ def summarize_news_flow(articles_data):
 # ==============================================================================
 def load_json_data(file_path):
     try:
-        with open(file_path, "r", encoding='utf-8') as f: return json.load(f)
-    except (FileNotFoundError, json.JSONDecodeError): return {}
+        with open(file_path, "rb") as f: return orjson.loads(f.read())
+    except (FileNotFoundError, orjson.JSONDecodeError): return {}
+
+def _write_bytes_atomic(payload, file_path):
+    # 先寫入暫存檔再以 os.replace 原子性替換，避免寫到一半中斷造成檔案毀損
+    # 暫存檔名帶上執行緒 id，背景寫檔與排程壓縮同時寫同一個檔案時不會互相覆蓋暫存檔
+    tmp_path = f"{file_path}.tmp.{threading.get_ident()}"
+    with open(tmp_path, "wb") as f: f.write(payload)
+    os.replace(tmp_path, file_path)
 
 def save_json_data(data, file_path):
     try:
-        with open(file_path, "w", encoding='utf-8') as f: json.dump(data, f, ensure_ascii=False, indent=4)
-    except Exception as e: logging.error(f"儲存檔案 {file_path} 失敗: {e}")
-
-USER_PREFERENCES = load_json_data(USER_PREFERENCES_FILE)
-CONVERSATION_HISTORY = load_json_data(CONVERSATION_HISTORY_FILE)
-NEWS_CACHE = load_json_data(NEWS_CACHE_FILE) 
+        # 以 orjson 在 C 層序列化 (輸出即為 UTF-8 bytes)；對話紀錄以 deque 保存，序列化時轉成 list
+        _write_bytes_atomic(orjson.dumps(data, default=list), file_path)
+        return True
+    except Exception as e:
+        logging.error(f"儲存檔案 {file_path} 失敗: {e}")
+        return False
+
+# --- 延遲批次寫檔 ---
+# 請求路徑上只標記「哪個檔案需要寫入」，由背景執行緒每 JSON_FLUSH_INTERVAL_SEC 秒合併寫入一次。
+_DIRTY_JSON_FILES = {}
+_DIRTY_JSON_LOCK = threading.Lock()
+_DIRTY_JSON_EVENT = threading.Event()
+
+def schedule_json_save(data, file_path):
+    with _DIRTY_JSON_LOCK:
+        _DIRTY_JSON_FILES[file_path] = data
+    _DIRTY_JSON_EVENT.set()
+
+def flush_json_data():
+    with _DIRTY_JSON_LOCK:
+        pending = dict(_DIRTY_JSON_FILES)
+        _DIRTY_JSON_FILES.clear()
+        _DIRTY_JSON_EVENT.clear()
+    for file_path, data in pending.items():
+        if not save_json_data(data, file_path):
+            # 序列化時資料剛好被其他執行緒修改等情況，留待下一輪再寫
+            schedule_json_save(data, file_path)
+
+def _json_flush_worker():
+    while True:
+        _DIRTY_JSON_EVENT.wait()
+        time.sleep(Config.JSON_FLUSH_INTERVAL_SEC)
+        flush_json_data()
+
+threading.Thread(target=_json_flush_worker, name="json-flusher", daemon=True).start()
+atexit.register(flush_json_data)
+
+# --- 增量日誌 (WAL) ---
+# 用戶偏好與對話紀錄的每筆變更只以一行 JSON 追加到 <file>.wal，寫入量與資料總量無關；
+# 由背景執行緒定期把記憶體中的完整資料壓縮回主檔並刪除 WAL，啟動時再把 WAL 重播到主檔內容上。
+_STORE_LOCK = threading.RLock()
+# 同一時間只允許一個壓縮流程 (定時壓縮與結束時的壓縮可能重疊)；寫入 WAL 的請求不受這把鎖影響
+_COMPACT_LOCK = threading.Lock()
+# 每筆 WAL 記錄帶有遞增的序號，壓縮時把目前序號一併寫入主檔快照；
+# 重播時略過序號不大於快照序號的記錄，壓縮寫完主檔但尚未刪除 .wal.old 就中斷時不會重複套用
+_WAL_SEQ_KEY = "__wal_seq__"
+_WAL_SEQ = {}
+
+def _apply_json_delta(store, record):
+    op, key, value = record.get("op"), record.get("k"), record.get("v")
+    if op == "set":
+        store[key] = value
+    elif op == "history_append":
+        # 以固定長度的 deque 保存，追加時自動丟棄最舊的訊息，不必每次切片複製
+        history = store.get(key)
+        if not isinstance(history, deque):
+            history = store[key] = deque(history or (), maxlen=Config.MAX_HISTORY_MESSAGES)
+        history.append(value)
+    return store.get(key)
+
+def append_json_delta(store, file_path, record):
+    """套用一筆變更到記憶體中的資料並寫入 WAL；兩者在同一把鎖內完成，壓縮時不會重複或遺漏。"""
+    with _STORE_LOCK:
+        result = _apply_json_delta(store, record)
+        record["seq"] = _WAL_SEQ[file_path] = _WAL_SEQ.get(file_path, 0) + 1
+        try:
+            with open(file_path + ".wal", "ab") as f:
+                f.write(orjson.dumps(record) + b"\n")
+        except OSError as e:
+            logging.error(f"寫入 WAL {file_path}.wal 失敗: {e}")
+        return result
+
+def load_json_store(file_path):
+    data = load_json_data(file_path)
+    snapshot_seq = last_seq = data.pop(_WAL_SEQ_KEY, 0)
+    # 壓縮中斷時 .wal.old 尚未併入主檔，需先於 .wal 重播
+    for wal_path in (file_path + ".wal.old", file_path + ".wal"):
+        try:
+            with open(wal_path, "rb") as f:
+                for line in f:
+                    try:
+                        record = orjson.loads(line)
+                    except ValueError:
+                        # 最後一行可能因中斷而不完整，之後的內容一律忽略
+                        break
+                    # 舊版記錄沒有序號，一律套用
+                    seq = record.get("seq", 0)
+                    if seq and seq <= snapshot_seq:
+                        continue
+                    _apply_json_delta(data, record)
+                    last_seq = max(last_seq, seq)
+        except FileNotFoundError:
+            pass
+    _WAL_SEQ[file_path] = last_seq
+    return data
+
+def compact_json_store(data, file_path):
+    """鎖內只輪替 WAL 並取得快照，寫入主檔在鎖外進行，不阻塞同時寫入 WAL 的請求。"""
+    wal_path, old_wal_path = file_path + ".wal", file_path + ".wal.old"
+    with _COMPACT_LOCK:
+        with _STORE_LOCK:
+            if not os.path.exists(wal_path):
+                return
+            try:
+                if os.path.exists(old_wal_path):
+                    # 上一次壓縮失敗留下的舊 WAL 還沒併入主檔，把目前的 WAL 接在後面一起保留
+                    with open(wal_path, "rb") as src, open(old_wal_path, "ab") as dst:
+                        dst.write(src.read())
+                    os.remove(wal_path)
+                else:
+                    os.replace(wal_path, old_wal_path)
+                snapshot = orjson.dumps({**data, _WAL_SEQ_KEY: _WAL_SEQ.get(file_path, 0)}, default=list)
+            except Exception as e:
+                logging.error(f"輪替 WAL {wal_path} 失敗: {e}")
+                return
+        try:
+            _write_bytes_atomic(snapshot, file_path)
+            os.remove(old_wal_path)
+        except OSError as e:
+            logging.error(f"壓縮檔案 {file_path} 失敗: {e}")
+
+def compact_json_stores():
+    compact_json_store(USER_PREFERENCES, Config.USER_PREFERENCES_FILE)
+    compact_json_store(CONVERSATION_HISTORY, Config.CONVERSATION_HISTORY_FILE)
+
+def _json_compact_worker():
+    # 在模組層級啟動，以 WSGI 伺服器載入時 (不經過 __main__) WAL 也會定期壓縮
+    while True:
+        time.sleep(Config.JSON_COMPACT_INTERVAL_SEC)
+        compact_json_stores()
+
+def record_preference(context_id, user_pref):
+    append_json_delta(USER_PREFERENCES, Config.USER_PREFERENCES_FILE, {"op": "set", "k": context_id, "v": user_pref})
+
+def append_history_message(context_id, message):
+    """追加一則對話紀錄並回傳裁切後的歷史清單。"""
+    return append_json_delta(CONVERSATION_HISTORY, Config.CONVERSATION_HISTORY_FILE, {"op": "history_append", "k": context_id, "v": message})
+
+USER_PREFERENCES = load_json_store(Config.USER_PREFERENCES_FILE)
+CONVERSATION_HISTORY = load_json_store(Config.CONVERSATION_HISTORY_FILE)
+threading.Thread(target=_json_compact_worker, name="json-compactor", daemon=True).start()
+atexit.register(compact_json_stores)
+NEWS_CACHE = load_json_data(Config.NEWS_CACHE_FILE) 
+RSS_CACHE = OrderedDict(load_json_data(Config.RSS_CACHE_FILE))
+RSS_CACHE_LOCK = threading.Lock()
+ARTICLE_CACHE = load_json_data(Config.ARTICLE_CACHE_FILE)
+ARTICLE_CACHE_LOCK = threading.Lock()
+
+def _news_cache_ttl(item):
+    return item.get("ttl", Config.NEWS_SUMMARY_CACHE_SECONDS)
+
+def _news_cache_effective_ttl(item):
+    """熱門主題延長後的 TTL 另存於 hot_ttl，不影響下一輪依 ttl 計算的調整。"""
+    return item.get("hot_ttl") or _news_cache_ttl(item)
+
+# 排程推播的時區 (Asia/Taipei 沒有日光節約時間，固定 UTC+8)
+_NEWS_PUSH_TZ = timezone(timedelta(hours=8))
+
+def _seconds_until_next_push(ts):
+    """回傳從 ts 到下一次排程推播 (Config.NEWS_PUSH_HOURS) 的秒數。"""
+    start = datetime.fromtimestamp(ts, tz=_NEWS_PUSH_TZ)
+    candidates = [
+        start.replace(hour=hour, minute=0, second=0, microsecond=0) + timedelta(days=day)
+        for day in (0, 1) for hour in Config.NEWS_PUSH_HOURS
+    ]
+    return min((c - start).total_seconds() for c in candidates if c > start)
+
+def _next_news_cache_ttl(previous_item, articles_digest):
+    """
+    依上一次的結果調整 TTL：重新抓到的新聞與上次完全相同代表主題更新慢，延長 TTL；
+    新聞有變動則縮短 TTL，讓快速變化的主題不會提供過時的摘要。
+    """
+    if not previous_item:
+        return Config.NEWS_SUMMARY_CACHE_SECONDS
+    ttl = _news_cache_ttl(previous_item)
+    if previous_item.get("articles_digest") == articles_digest:
+        return min(ttl * 1.5, Config.NEWS_CACHE_MAX_TTL_SECONDS)
+    return max(ttl / 2, Config.NEWS_CACHE_MIN_TTL_SECONDS)
+
+def _prune_news_cache(now=None):
+    """
+    已過期的新聞快取只丟棄摘要內容，保留 ttl 與 articles_digest，讓下次重新產生時仍能依上一輪結果調整 TTL；
+    若數量超過 NEWS_CACHE_MAX_ENTRIES，依命中次數 (LFU) 淘汰最少被使用的項目，次數相同時先淘汰較舊的。
+    """
+    now = now or time.time()
+    for key, item in list(NEWS_CACHE.items()):
+        if "reply_content" in item and now - item.get("timestamp", 0) >= _news_cache_effective_ttl(item):
+            NEWS_CACHE[key] = {
+                "timestamp": item.get("timestamp", 0),
+                "hits": 0,
+                "ttl": _news_cache_ttl(item),
+                "articles_digest": item.get("articles_digest"),
+            }
+    overflow = len(NEWS_CACHE) - Config.NEWS_CACHE_MAX_ENTRIES
+    if overflow > 0:
+        victims = sorted(NEWS_CACHE.items(), key=lambda kv: (kv[1].get("hits", 0), kv[1].get("timestamp", 0)))[:overflow]
+        for key, _ in victims:
+            NEWS_CACHE.pop(key, None)
+
+# 啟動時丟棄檔案中已過期項目的摘要內容，並以 LFU 上限避免快取檔隨關鍵字種類無限成長
+_prune_news_cache()
+
+# 金鑰處理只在啟動時做一次，每個請求從這個範本 copy() 後再計算內容的雜湊
+_LINE_HMAC_TEMPLATE = hmac.new(Config.LINE_CHANNEL_SECRET.encode('utf-8'), digestmod=hashlib.sha256) if Config.LINE_CHANNEL_SECRET else None
 
 def validate_signature(request_body_bytes, signature_header):
-    if not LINE_CHANNEL_SECRET: return True
-    hash_obj = hmac.new(LINE_CHANNEL_SECRET.encode('utf-8'), request_body_bytes, hashlib.sha256)
-    generated_signature = base64.b64encode(hash_obj.digest()).decode('utf-8')
-    return hmac.compare_digest(generated_signature, signature_header)
+    if _LINE_HMAC_TEMPLATE is None: return True
+    if not signature_header: return False
+    # 直接比對 32 bytes 的原始摘要，不必把算出的摘要再做一次 base64 編碼
+    try:
+        received_digest = base64.b64decode(signature_header, validate=True)
+    except ValueError:
+        # binascii.Error 與非 ASCII 字元造成的錯誤都是 ValueError 的子類別
+        return False
+    hash_obj = _LINE_HMAC_TEMPLATE.copy()
+    hash_obj.update(request_body_bytes)
+    return hmac.compare_digest(hash_obj.digest(), received_digest)
 
 def _utf16_len(s: str) -> int:
-    return len(s.encode('utf-16-le')) // 2
+    # BMP 字元佔 1 個 UTF-16 單位，補充平面字元 (如 emoji) 以代理對表示佔 2 個
+    n = len(s)
+    # max() 在 C 層掃過字串；一般中文新聞沒有補充平面字元，不必進入逐字計數的 Python 迴圈
+    if n and max(s) > '\uffff':
+        n += sum(1 for ch in s if ch > '\uffff')
+    return n
 
 def _slice_by_utf16(s: str, max_units: int):
-    buf, acc = [], 0
-    for ch in s:
-        u = _utf16_len(ch)
-        if acc + u > max_units:
-            yield ''.join(buf)
-            buf, acc = [ch], u
-        else:
-            buf.append(ch); acc += u
-    if buf: yield ''.join(buf)
+    # 整段只編碼一次，直接以 bytes 位移切割 (每個 UTF-16 單位 2 bytes)，不逐字走 Python 迴圈
+    buf = s.encode('utf-16-le')
+    step = max_units * 2
+    start, end = 0, len(buf)
+    while start < end:
+        cut = min(start + step, end)
+        # 切點前一個單位若是高代理 (0xD800-0xDBFF)，往前退一個單位，避免把代理對拆開
+        if cut < end and 0xD8 <= buf[cut - 1] <= 0xDB:
+            cut = cut - 2 if cut - 2 > start else cut + 2
+        yield buf[start:cut].decode('utf-16-le')
+        start = cut
     
 def split_long_message(text, limit=None):
     if not text or not text.strip():
         return []
     limit = limit or 5000
 
-    if _utf16_len(text) <= limit:
+    # 每個字元最多佔 2 個 UTF-16 單位，夠短的訊息不必逐字計算長度
+    if len(text) * 2 <= limit or _utf16_len(text) <= limit:
         return [text.strip()]
     messages = []
-    current = ""
+    # 以段落清單與累計長度 acc 組合訊息，避免反覆串接字串並重新計算長度
+    parts, acc = [], 0
     for para in text.split('\n'):
-        if _utf16_len(current + para + '\n') <= limit:
-            current += para + '\n'
+        units = _utf16_len(para) + 1  # 含段落結尾的換行
+        if acc + units <= limit:
+            parts.append(para); acc += units
         else:
-            if current:
-                messages.append(current.strip()); current = ""
-            if _utf16_len(para) > limit:
-                messages.extend(list(_slice_by_utf16(para, limit)))
+            if parts:
+                messages.append('\n'.join(parts).strip()); parts, acc = [], 0
+            if units - 1 > limit:
+                messages.extend(_slice_by_utf16(para, limit))
             else:
-                current = para + '\n'
-    if current:
-        messages.append(current.strip())
+                parts, acc = [para], units
+    if parts:
+        messages.append('\n'.join(parts).strip())
 
-    if len(messages) > 1:
-        messages = [f"({i+1}/{len(messages)})\n{m}" for i, m in enumerate(messages)]
+    total = len(messages)
+    if total > 1:
+        messages = [f"({i}/{total})\n{m}" for i, m in enumerate(messages, 1)]
     return messages
 
-LAST_PUSH_TS = 0
 MIN_PUSH_INTERVAL_SEC = float(os.getenv("LINE_MIN_PUSH_INTERVAL_SEC", "1.2"))
+# 所有推播執行緒共用，容量 1 代表任兩次 Push 之間至少間隔 MIN_PUSH_INTERVAL_SEC
+PUSH_RATE_LIMITER = TokenBucket(rate=1 / MIN_PUSH_INTERVAL_SEC, capacity=1)
 
 def _throttle():
-    global LAST_PUSH_TS
-    now = time.time()
-    gap = now - LAST_PUSH_TS
-    if gap < MIN_PUSH_INTERVAL_SEC:
-        time.sleep(MIN_PUSH_INTERVAL_SEC - gap)
-    LAST_PUSH_TS = time.time()
+    PUSH_RATE_LIMITER.acquire()
 
 def send_line_messages(context_id, reply_token_or_none, text_messages_list):
     if not text_messages_list: return
-    headers = {"Authorization": f"Bearer {LINE_CHANNEL_ACCESS_TOKEN}", "Content-Type": "application/json"}
 
-    def _push_one(msg_text):
+    # LINE 的 reply/push 每次請求最多可帶 5 則訊息，依此分批，一批只需一次 HTTP 請求
+    batch_size = Config.LINE_MAX_MESSAGES_PER_REQUEST
+    batches = [
+        [{"type": "text", "text": str(m)} for m in text_messages_list[i:i + batch_size]]
+        for i in range(0, len(text_messages_list), batch_size)
+    ]
+
+    def _push_batch(messages):
         _throttle()
-        payload = {"to": context_id, "messages": [{"type": "text", "text": str(msg_text)}]}
-        r = requests.post("https://api.line.me/v2/bot/message/push", headers=headers, json=payload, timeout=20)
+        payload = orjson.dumps({"to": context_id, "messages": messages})
+        r = LINE_SESSION.post("https://api.line.me/v2/bot/message/push", headers=LINE_JSON_HEADERS, data=payload, timeout=20)
         if r.status_code == 429:
             logging.warning("Push 429，將延遲重試一次...")
             time.sleep(MIN_PUSH_INTERVAL_SEC * 2.5)
             _throttle()
-            r = requests.post("https://api.line.me/v2/bot/message/push", headers=headers, json=payload, timeout=20)
+            r = LINE_SESSION.post("https://api.line.me/v2/bot/message/push", headers=LINE_JSON_HEADERS, data=payload, timeout=20)
         r.raise_for_status()
 
     is_first_replied = False
     if reply_token_or_none:
         try:
-            payload = {"replyToken": reply_token_or_none, "messages": [{"type": "text", "text": str(text_messages_list[0])}]}
-            r = requests.post("https://api.line.me/v2/bot/message/reply", headers=headers, json=payload, timeout=20)
+            payload = orjson.dumps({"replyToken": reply_token_or_none, "messages": batches[0]})
+            r = LINE_SESSION.post("https://api.line.me/v2/bot/message/reply", headers=LINE_JSON_HEADERS, data=payload, timeout=20)
             r.raise_for_status()
             is_first_replied = True
         except requests.exceptions.RequestException as e:
             logging.error(f"Reply 失敗，改用 Push：{e}")
 
     start = 1 if is_first_replied else 0
-    for i in range(start, len(text_messages_list)):
+    for i in range(start, len(batches)):
         try:
-            _push_one(text_messages_list[i])
+            _push_batch(batches[i])
         except requests.exceptions.RequestException as e:
-            logging.error(f"Push 失敗 part {i+1}：{e}")
+            logging.error(f"Push 失敗 batch {i+1}/{len(batches)}：{e}")
             break
         
 def get_user_profile(context_id, user_id):
     cache_key = (context_id, user_id)
     current_time = time.time()
-    if cache_key in USER_PROFILE_CACHE and current_time - USER_PROFILE_CACHE[cache_key]['timestamp'] < USER_PROFILE_CACHE_SECONDS:
-        return USER_PROFILE_CACHE[cache_key]['displayName']
+    with USER_PROFILE_CACHE_LOCK:
+        cached = USER_PROFILE_CACHE.get(cache_key)
+        if cached:
+            if current_time - cached['timestamp'] < Config.USER_PROFILE_CACHE_SECONDS:
+                USER_PROFILE_CACHE.move_to_end(cache_key)
+                return cached['displayName']
+            del USER_PROFILE_CACHE[cache_key]
     if context_id.startswith('G') or context_id.startswith('R'): url = f"https://api.line.me/v2/bot/group/{context_id}/member/{user_id}"
     elif context_id.startswith('U'): url = f"https://api.line.me/v2/bot/profile/{user_id}"
     else: return "未知用戶"
-    headers = {"Authorization": f"Bearer {LINE_CHANNEL_ACCESS_TOKEN}"}
     try:
-        response = requests.get(url, headers=headers, timeout=10)
+        response = LINE_SESSION.get(url, timeout=10)
         response.raise_for_status()
-        profile_data = response.json()
+        profile_data = orjson.loads(response.content)
         display_name = profile_data.get("displayName", "無名氏")
-        USER_PROFILE_CACHE[cache_key] = {"displayName": display_name, "timestamp": current_time}
+        with USER_PROFILE_CACHE_LOCK:
+            USER_PROFILE_CACHE[cache_key] = {"displayName": display_name, "timestamp": current_time}
+            USER_PROFILE_CACHE.move_to_end(cache_key)
+            while len(USER_PROFILE_CACHE) > Config.USER_PROFILE_CACHE_MAX_ENTRIES:
+                USER_PROFILE_CACHE.popitem(last=False)
         logging.info(f"透過 API 取得用戶 {user_id} 的名稱: {display_name}，並已更新快取。")
         return display_name
-    except requests.exceptions.RequestException as e:
+    except (requests.exceptions.RequestException, ValueError) as e:
         logging.warning(f"無法獲取用戶 {user_id} 的個人資料: {e}")
         return "某位成員"
 
 # ==============================================================================
 # --- 核心業務邏輯與 Webhook 事件處理 ---
 # ==============================================================================
+# --- 新聞摘要 single-flight ---
+# 相同 cache_key 同一時間只由一個執行緒產生摘要，其他請求等待後直接使用快取結果
+_NEWS_INFLIGHT = {}
+_NEWS_INFLIGHT_LOCK = threading.Lock()
+
+def news_cache_key(keywords):
+    """
+    把關鍵字正規化為新聞快取的 key，讓只差在大小寫、空白或詞序的訂閱共用同一份摘要。
+    Google News 搜尋不分大小寫，但運算子 OR 必須保持大寫；
+    只有純 AND (空白分隔) 或純 OR 清單時詞序才不影響結果，含引號、括號或混用時保留原順序。
+    """
+    tokens = [t if t == "OR" else t.casefold() for t in (keywords or "").split()]
+    if not tokens:
+        return "__DEFAULT__"
+    if '"' not in keywords and '(' not in keywords:
+        terms = tokens[::2]
+        if "OR" not in tokens:
+            return " ".join(sorted(set(tokens)))
+        if len(tokens) % 2 and all(t == "OR" for t in tokens[1::2]) and "OR" not in terms:
+            return " OR ".join(sorted(set(terms)))
+    return " ".join(tokens)
+
+def _serve_news_from_cache(user_id, reply_token, cache_key, theme_name, current_time, count_hit=True):
+    """快取有效時直接推送並回傳 True；count_hit 為 False (排程推播) 時不計入命中次數。"""
+    # 過期項目可能只剩 TTL 中繼資料 (沒有 reply_content)，視同未命中；其餘項目一定帶有 timestamp
+    cached_item = NEWS_CACHE.get(cache_key)
+    if not cached_item or not cached_item.get("reply_content"):
+        return False
+    cache_age = current_time - cached_item["timestamp"]
+    if cache_age >= _news_cache_effective_ttl(cached_item):
+        return False
+    logging.info(f"新聞快取命中！(關鍵字: '{cache_key}', 年齡: {int(cache_age)}秒)")
+    if count_hit:
+        cached_item["hits"] = cached_item.get("hits", 0) + 1
+        # 短時間內被大量查詢的主題延長 TTL：每個快取項目只延長一次，且不超過下一次排程推播
+        if "hot_ttl" not in cached_item and cached_item["hits"] / max(cache_age / 3600, 1) >= Config.NEWS_CACHE_HOT_HITS_PER_HOUR:
+            base_ttl = _news_cache_ttl(cached_item)
+            cached_item["hot_ttl"] = max(base_ttl, min(
+                base_ttl * 1.5, Config.NEWS_CACHE_MAX_TTL_SECONDS, _seconds_until_next_push(cached_item["timestamp"])))
+    cached_reply_content = cached_item["reply_content"]
+    # 摘要在寫入快取時已切割好；舊版快取項目沒有 reply_chunks 時才在此切割
+    reply_chunks = cached_item.get("reply_chunks") or split_long_message(cached_reply_content)
+    messages_to_send = ["".join(("這份新聞摘要根據「", theme_name, "」主題產生（從快取提供😊）"))]
+    messages_to_send.extend(reply_chunks)
+    send_line_messages(user_id, reply_token, messages_to_send)
+    return True
+
 def generate_and_push_news_for_user(user_id, user_custom_keywords=None, is_immediate_push=False, reply_token=None):
     log_prefix = "即時請求" if is_immediate_push else "排程推播"
     logging.info(f"[{log_prefix}] 開始為用戶 {user_id} 處理新聞請求...")
     
     theme_name = user_custom_keywords if user_custom_keywords else "預設 AI 主題"
-    cache_key = user_custom_keywords if user_custom_keywords else "__DEFAULT__"
+    cache_key = news_cache_key(user_custom_keywords)
     current_time = time.time()
 
-    if cache_key in NEWS_CACHE:
-        cached_item = NEWS_CACHE[cache_key]
-        cache_age = current_time - cached_item.get("timestamp", 0)
-        
-        if cache_age < NEWS_SUMMARY_CACHE_SECONDS:
-            logging.info(f"新聞快取命中！(關鍵字: '{cache_key}', 年齡: {int(cache_age)}秒)")
-            cached_reply_content = cached_item.get("reply_content")
-            if cached_reply_content:
-                final_reply = f"這份新聞摘要根據「{theme_name}」主題產生（從快取提供😊）\n\n{cached_reply_content}"
-                send_line_messages(user_id, reply_token, split_long_message(final_reply))
-                return
-
-    logging.info(f"新聞快取未命中或已過期 (關鍵字: '{cache_key}')，執行完整新聞摘要流程。")
-    articles = fetch_and_parse_articles(custom_query=user_custom_keywords, limit=NEWS_FETCH_TARGET_COUNT)
-    if not articles:
-        send_line_messages(user_id, reply_token, [f"抱歉，目前未能根據您的關鍵字「{theme_name}」找到可成功擷取的新聞。"])
+    if _serve_news_from_cache(user_id, reply_token, cache_key, theme_name, current_time, count_hit=is_immediate_push):
         return
 
-    final_summary_raw = summarize_news_flow(articles)
-    if not final_summary_raw or final_summary_raw.startswith("抱歉，"):
-        send_line_messages(user_id, reply_token, [final_summary_raw or "抱歉，今日新聞摘要生成異常，內容為空。"])
-        return
+    # 前一個負責產生摘要的請求失敗 (沒有寫入快取) 時，等待者中只有一個會接手成為新的負責者，其餘繼續等待
+    while True:
+        with _NEWS_INFLIGHT_LOCK:
+            inflight = _NEWS_INFLIGHT.get(cache_key)
+            is_leader = inflight is None
+            if is_leader:
+                inflight = _NEWS_INFLIGHT[cache_key] = threading.Event()
+        if is_leader:
+            break
+        logging.info(f"關鍵字 '{cache_key}' 的新聞摘要正由其他請求產生中，等待其結果...")
+        if not inflight.wait(timeout=Config.NEWS_INFLIGHT_WAIT_SECONDS):
+            logging.warning(f"等待新聞摘要逾時 (關鍵字: '{cache_key}')。")
+            send_line_messages(user_id, reply_token, [f"抱歉，「{theme_name}」的新聞摘要產生時間過長，請稍後再試。"])
+            return
+        if _serve_news_from_cache(user_id, reply_token, cache_key, theme_name, time.time(), count_hit=is_immediate_push):
+            return
+        logging.warning(f"等待的新聞摘要未能產生快取 (關鍵字: '{cache_key}')，重新嘗試產生。")
 
-    parsed_result = handle_llm_response_with_think(final_summary_raw)
-    thinking_messages = parsed_result["thinking_messages"]
-    formal_messages = parsed_result["formal_messages"]
-
-    final_formal_reply_for_cache = ""
-    if formal_messages:
-        generation_time = datetime.fromtimestamp(current_time)
-        time_str = generation_time.strftime("%Y-%m-%d %H:%M")
-        full_formal_text = "\n".join(formal_messages)
-        final_formal_reply_for_cache = f"產生於 {time_str}\n\n{full_formal_text}"
-    
-    if final_formal_reply_for_cache:
-        NEWS_CACHE[cache_key] = {
-            "timestamp": current_time,
-            "reply_content": final_formal_reply_for_cache
-        }
-        save_json_data(NEWS_CACHE, NEWS_CACHE_FILE)
-        logging.info(f"已更新新聞快取 (關鍵字: '{cache_key}')。")
+    cached_item = NEWS_CACHE.get(cache_key)
+    try:
+        logging.info(f"新聞快取未命中或已過期 (關鍵字: '{cache_key}')，執行完整新聞摘要流程。")
+        # 文章一邊抓取一邊交給第一階段摘要；articles 同時收集實際處理過的文章
+        articles = []
+        final_summary_raw = summarize_news_flow(_collect_into(articles, iter_articles_cached(custom_query=user_custom_keywords, limit=Config.NEWS_FETCH_TARGET_COUNT)))
+        if not articles:
+            send_line_messages(user_id, reply_token, [f"抱歉，目前未能根據您的關鍵字「{theme_name}」找到可成功擷取的新聞。"])
+            return
+
+        if not final_summary_raw or final_summary_raw.startswith("抱歉，"):
+            send_line_messages(user_id, reply_token, [final_summary_raw or "抱歉，今日新聞摘要生成異常，內容為空。"])
+            return
 
-    final_reply_for_user = f"這份新聞摘要根據「{theme_name}」主題產生\n\n{final_formal_reply_for_cache}"
+        parsed_result = handle_llm_response_with_think(final_summary_raw)
+        thinking_messages = parsed_result["thinking_messages"]
+        formal_text = parsed_result["formal_text"]
+
+        final_formal_reply_for_cache = ""
+        reply_chunks = []
+        if formal_text:
+            generation_time = datetime.fromtimestamp(current_time)
+            time_str = generation_time.strftime("%Y-%m-%d %H:%M")
+            final_formal_reply_for_cache = f"產生於 {time_str}\n\n" + formal_text
+            # 主題標頭因用戶而異，另成一則訊息；摘要本身只切割一次，之後命中快取的用戶直接沿用
+            reply_chunks = split_long_message(final_formal_reply_for_cache)
     
-    messages_to_send = thinking_messages + split_long_message(final_reply_for_user)
+        if final_formal_reply_for_cache:
+            articles_digest = hashlib.sha1("\n".join(sorted(a['url'] for a in articles)).encode('utf-8')).hexdigest()
+            NEWS_CACHE[cache_key] = {
+                "timestamp": current_time,
+                "reply_content": final_formal_reply_for_cache,
+                "reply_chunks": reply_chunks,
+                "hits": 0,
+                "ttl": _next_news_cache_ttl(cached_item, articles_digest),
+                "articles_digest": articles_digest
+            }
+            _prune_news_cache(current_time)
+            schedule_json_save(NEWS_CACHE, Config.NEWS_CACHE_FILE)
+            logging.info(f"已更新新聞快取 (關鍵字: '{cache_key}')。")
+    finally:
+        if is_leader:
+            with _NEWS_INFLIGHT_LOCK:
+                _NEWS_INFLIGHT.pop(cache_key, None)
+            inflight.set()
+
+    final_reply_for_user = "".join(("這份新聞摘要根據「", theme_name, "」主題產生\n\n", final_formal_reply_for_cache))
+    
+    # thinking_messages 是 handle_llm_response_with_think 新建的清單，直接就地延伸
+    messages_to_send = thinking_messages
+    messages_to_send.append("".join(("這份新聞摘要根據「", theme_name, "」主題產生")))
+    messages_to_send.extend(reply_chunks)
     send_line_messages(user_id, reply_token, messages_to_send)
     
     logging.info(f"[{log_prefix}] 已完成對用戶 {user_id} 的新聞推送。")
 
     # --- [NEW] 將推播內容寫入對話紀錄，讓機器人有記憶 ---
     try:
-        history = CONVERSATION_HISTORY.get(user_id, [])
-        # 模擬 assistant 的發言紀錄
-        history.append({
+        # 模擬 assistant 的發言紀錄 (長度限制由 append_history_message 維持)
+        append_history_message(user_id, {
             "role": "assistant", 
             "content": final_reply_for_user,
             "timestamp": datetime.now().strftime('%Y-%m-%d %H:%M:%S')
         })
-        
-        # 維持紀錄長度限制
-        if len(history) > MAX_HISTORY_MESSAGES:
-            history = history[-MAX_HISTORY_MESSAGES:]
-            
-        CONVERSATION_HISTORY[user_id] = history
-        save_json_data(CONVERSATION_HISTORY, CONVERSATION_HISTORY_FILE)
         logging.info(f"[{log_prefix}] 已將新聞內容寫入用戶 {user_id} 的對話紀錄。")
     except Exception as e:
         logging.error(f"[{log_prefix}] 寫入對話紀錄時發生錯誤: {e}")
 
-def generate_news_for_single_user_job(user_id, keywords, remaining_users, is_immediate=False):
-    with app.app_context():
-        log_prefix = "背景即時請求" if is_immediate else "背景排程推播"
-        logging.info(f"[{log_prefix}] 任務鏈啟動，為用戶 {user_id} 產生新聞...")
+def _push_worker_app_context():
+    # app context 綁定在執行緒上；作為執行緒池的 initializer，每個工作執行緒啟動時推入一次，之後的工作都共用
+    app.app_context().push()
+
+def generate_news_for_single_user_job(user_id, keywords, is_immediate=False):
+    log_prefix = "背景即時請求" if is_immediate else "背景排程推播"
+    logging.info(f"[{log_prefix}] 開始為用戶 {user_id} 產生新聞...")
+    try:
+        generate_and_push_news_for_user(user_id=user_id, user_custom_keywords=keywords, is_immediate_push=is_immediate, reply_token=None)
+    except Exception as e:
+        logging.error(f"[{log_prefix}] 背景任務為用戶 {user_id} 產生新聞時發生未預期錯誤: {e}", exc_info=True)
+
+def _push_news_to_keyword_group(members):
+    # 同組用戶依序處理：第一位產生摘要並寫入 NEWS_CACHE，其餘用戶直接命中快取
+    for user_id, keywords in members:
+        generate_news_for_single_user_job(user_id, keywords, False)
+
+def run_news_batch_job(users):
+    """
+    訂閱者依正規化後的關鍵字分組，每組只抓取與摘要一次，結果再分送給組內所有用戶；
+    以最多 NEWS_CONCURRENCY 個執行緒同時處理不同的組，LLM 與 LINE Push 各自有共用的速率限制。
+    """
+    groups = {}
+    for user_id, keywords in users:
+        groups.setdefault(news_cache_key(keywords), []).append((user_id, keywords))
+    max_workers = max(1, min(Config.NEWS_CONCURRENCY, len(groups)))
+    logging.info(f"推播批次：開始處理 {len(users)} 位用戶 ({len(groups)} 組關鍵字)，最大平行度: {max_workers}")
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="news-batch", initializer=_push_worker_app_context) as executor:
+        for members in groups.values():
+            executor.submit(_push_news_to_keyword_group, members)
+    logging.info("推播批次：所有用戶處理完成。")
+
+# --- Webhook 事件處理執行緒池 ---
+# LINE 可能在同一次 webhook 請求中批次送來多個事件，交給背景執行緒處理，讓 webhook 立即回應 200。
+WEBHOOK_EXECUTOR = ThreadPoolExecutor(max_workers=Config.WEBHOOK_MAX_WORKERS, thread_name_prefix="webhook")
+
+# --- 即時新聞請求執行緒池 ---
+# 所有「新聞」指令共用同一個池；排隊加執行中的請求超過 NEWS_MAX_PENDING_REQUESTS 時直接回覆忙碌，不再無限累積
+NEWS_EXECUTOR = ThreadPoolExecutor(max_workers=Config.NEWS_WORKERS, thread_name_prefix="news", initializer=_push_worker_app_context)
+_NEWS_REQUEST_SLOTS = threading.BoundedSemaphore(Config.NEWS_MAX_PENDING_REQUESTS)
+atexit.register(lambda: NEWS_EXECUTOR.shutdown(wait=False, cancel_futures=True))
+
+def reserve_news_request_slot():
+    """預留一個即時新聞請求名額；佇列已滿時回傳 False。"""
+    return _NEWS_REQUEST_SLOTS.acquire(blocking=False)
+
+def submit_news_request(fn, *args, **kwargs):
+    """把已預留名額的即時新聞請求交給共用執行緒池，完成後釋放名額；無法提交時回傳 False。"""
+    try:
+        future = NEWS_EXECUTOR.submit(fn, *args, **kwargs)
+    except RuntimeError:
+        # 直譯器關閉中，執行緒池已不再接受工作
+        _NEWS_REQUEST_SLOTS.release()
+        return False
+    future.add_done_callback(lambda _: _NEWS_REQUEST_SLOTS.release())
+    return True
+
+def _dispatch_event(context_id, event):
+    source, event_type, reply_token = event.get("source", {}), event.get("type"), event.get("replyToken")
+    logging.info(f"收到事件: type={event_type}, source_type={source.get('type')}, context_id={context_id}")
+    if event_type == "message" and event.get("message", {}).get("type") == "text":
+        handle_text_message_event(context_id=context_id, user_id=source.get('userId'), reply_token=reply_token, user_text=event["message"]["text"])
+    elif event_type == "follow":
+        user_pref = dict(USER_PREFERENCES.get(context_id, {}))
+        user_pref["subscribed_news"] = True
+        record_preference(context_id, user_pref)
+        send_line_messages(context_id, reply_token, ["感謝您加我好友！輸入 `/bot 幫助` 可以查看所有指令喔。"])
+    elif event_type == "unfollow" and context_id in USER_PREFERENCES:
+        record_preference(context_id, {**USER_PREFERENCES[context_id], "subscribed_news": False})
+
+def _process_context_events(context_id, events):
+    """
+    同一個聊天室的事件依序處理，確保對話紀錄的順序正確；
+    不同聊天室的事件則由 WEBHOOK_EXECUTOR 平行處理。
+    """
+    for event in events:
         try:
-            generate_and_push_news_for_user(user_id=user_id, user_custom_keywords=keywords, is_immediate_push=is_immediate, reply_token=None)
+            _dispatch_event(context_id, event)
         except Exception as e:
-            logging.error(f"[{log_prefix}] 背景任務為用戶 {user_id} 產生新聞時發生未預期錯誤: {e}", exc_info=True)
-        finally:
-            if remaining_users:
-                next_user_id, next_user_keywords = remaining_users[0]
-                next_remaining_users = remaining_users[1:]
-                run_time = datetime.now(scheduler.timezone) + timedelta(seconds=10)
-                job_id = f"scheduled_chain_{next_user_id}_{int(run_time.timestamp())}"
-                scheduler.add_job(generate_news_for_single_user_job, 'date', run_date=run_time, args=[next_user_id, next_user_keywords, next_remaining_users, False], id=job_id)
-                logging.info(f"任務鏈：為用戶 {user_id} 的任務已完成，已註冊下一個任務給 {next_user_id}。")
-            else:
-                logging.info(f"任務鏈：為用戶 {user_id} 的任務已完成，任務鏈結束。")
+            logging.error(f"處理 {context_id} 的事件時發生錯誤: {e}", exc_info=True)
+
+# 成功回應的內容固定不變，啟動時序列化一次即可
+_WEBHOOK_SUCCESS_BODY = orjson.dumps({"status": "success"})
+_JSON_RESPONSE_HEADERS = {"Content-Type": "application/json"}
 
 @app.route('/webhook', methods=['POST'])
 def webhook():
@@ -807,163 +1680,167 @@ def webhook():
         logging.error("Webhook: Invalid signature.")
         return jsonify({"status": "invalid signature"}), 400
     try:
-        data = request.json
+        # 簽章驗證已取得原始 bytes，直接以 orjson 解析，不必再讓 Flask 重讀一次 body
+        data = orjson.loads(body_bytes)
+        events_by_context = {}
         for event in data.get("events", []):
-            source, event_type, reply_token = event.get("source", {}), event.get("type"), event.get("replyToken")
+            source = event.get("source", {})
             source_type = source.get("type")
             context_id = source.get(f'{source_type}Id') if source_type else None
             if not context_id: continue
-            logging.info(f"收到事件: type={event_type}, source_type={source_type}, context_id={context_id}")
-            if event_type == "message" and event.get("message", {}).get("type") == "text":
-                handle_text_message_event(context_id=context_id, user_id=source.get('userId'), reply_token=reply_token, user_text=event["message"]["text"])
-            elif event_type == "follow":
-                user_pref = USER_PREFERENCES.get(context_id, {})
-                user_pref["subscribed_news"] = True
-                USER_PREFERENCES[context_id] = user_pref
-                save_json_data(USER_PREFERENCES, USER_PREFERENCES_FILE)
-                send_line_messages(context_id, reply_token, ["感謝您加我好友！輸入 `/bot 幫助` 可以查看所有指令喔。"])
-            elif event_type == "unfollow" and context_id in USER_PREFERENCES:
-                USER_PREFERENCES[context_id]["subscribed_news"] = False
-                save_json_data(USER_PREFERENCES, USER_PREFERENCES_FILE)
-        return jsonify({"status": "success"}), 200
+            events_by_context.setdefault(context_id, []).append(event)
+        for context_id, events in events_by_context.items():
+            WEBHOOK_EXECUTOR.submit(_process_context_events, context_id, events)
+        return _WEBHOOK_SUCCESS_BODY, 200, _JSON_RESPONSE_HEADERS
     except Exception as e:
         logging.error(f"處理 webhook 時發生錯誤: {e}", exc_info=True)
         return jsonify({"status": "error", "message": str(e)}), 500
 
 def handle_llm_response_with_think(llm_full_response):
-    think_pattern = re.compile(r"<think>(.*?)</think>", re.DOTALL | re.IGNORECASE)
-    result = {"thinking_messages": [], "formal_messages": []}
-    show_thinking = os.getenv("SHOW_THINKING_PROCESS", "false").lower() == "true"
-    fallback_on_empty = os.getenv("FALLBACK_ON_EMPTY", "true").lower() == "true"
-    match = think_pattern.search(llm_full_response or "")
-    if match:
+    """
+    拆出 <think> 思考過程與正式回答。formal_text 是未切割的正式回答 (寫入紀錄或快取用)，
+    formal_messages 是依 LINE 長度限制切割後、可直接送出的訊息清單。
+    """
+    result = {"thinking_messages": [], "formal_text": "", "formal_messages": []}
+    text = llm_full_response or ""
+    match = _THINK_RE.search(text)
+    if not match:
+        formal_text = text.strip()
+    else:
         thinking_text = (match.group(1) or "").strip()
-        formal_text = (llm_full_response[match.end():] or "").strip()
-        if thinking_text and show_thinking:
+        formal_text = text[match.end():].strip()
+        if thinking_text and Config.SHOW_THINKING_PROCESS:
             result["thinking_messages"] = split_long_message(f"⚙️ 我的思考過程：\n{thinking_text}")
-        if formal_text:
-            result["formal_messages"] = split_long_message(formal_text)
-        else:
-            if fallback_on_empty:
-                cleaned = think_pattern.sub("", llm_full_response or "").strip()
-                if cleaned:
-                    result["formal_messages"] = split_long_message(cleaned)
-                else:
-                    raw = (llm_full_response or "").strip()
-                    if raw:
-                        result["formal_messages"] = split_long_message(raw)
-    else:
-        cleaned = (llm_full_response or "").strip()
-        if cleaned:
-            result["formal_messages"] = split_long_message(cleaned)
-        elif fallback_on_empty:
-            result["formal_messages"] = split_long_message(llm_full_response or "")
+        if not formal_text and Config.FALLBACK_ON_EMPTY:
+            # 正式回答為空時，改用移除 <think> 區塊後的內容，再不行才用原始回應
+            formal_text = _THINK_RE.sub("", text, count=1).strip() or text.strip()
+    if formal_text:
+        result["formal_text"] = formal_text
+        result["formal_messages"] = split_long_message(formal_text)
     return result
 
+# --- 指令處理函式 ---
+# 每個指令一個函式，統一參數 (context_id, reply_token, command_text, rest)，由 COMMAND_HANDLERS 以指令名稱查表分派
+def _handle_news_command(context_id, reply_token, command_text, rest):
+    logging.info("偵測到「新聞一次性查詢」指令。")
+    final_keywords = None; user_input_part = rest
+    if user_input_part:
+        if user_input_part.lower().startswith("關鍵字:"): final_keywords = user_input_part[len("關鍵字:"):].strip()
+        else: final_keywords = user_input_part
+    else:
+        user_pref = USER_PREFERENCES.get(context_id, {});
+        if user_pref.get("subscribed_news") and user_pref.get("news_keywords"): final_keywords = user_pref.get("news_keywords")
+    # 使用背景執行緒處理，避免 webhook 超時。
+    # reply token 只能用一次，保留給下方的處理中訊息；背景任務完成後一律以 push 送出內容。
+    if not reserve_news_request_slot():
+        logging.warning("即時新聞請求佇列已滿，拒絕本次請求。")
+        send_line_messages(context_id, reply_token, ["目前新聞請求較多，請稍後再試一次 🙏"])
+        return
+    # 先回覆處理中訊息再提交背景任務，快取命中時推送的摘要才不會比這則訊息先到
+    send_line_messages(context_id, reply_token, ["收到！正在為您客製化新聞摘要，請稍候... 🚀"])
+    if not submit_news_request(generate_and_push_news_for_user, user_id=context_id, user_custom_keywords=final_keywords, is_immediate_push=True, reply_token=None):
+        logging.error("即時新聞請求無法提交到執行緒池 (服務關閉中)。")
+
+def _handle_subscribe_command(context_id, reply_token, command_text, rest):
+    logging.info("偵測到「訂閱」指令。")
+    keywords_to_subscribe = rest
+    user_pref = dict(USER_PREFERENCES.get(context_id, {})); user_pref["subscribed_news"] = True; user_pref["news_keywords"] = keywords_to_subscribe or None
+    reply_msg = f"✅ 設定成功！已為您訂閱每日新聞，主題為：「{keywords_to_subscribe or '預設 AI 主題'}」。"
+    record_preference(context_id, user_pref)
+    send_line_messages(context_id, reply_token, [reply_msg])
+
+def _handle_view_subscription_command(context_id, reply_token, command_text, rest):
+    user_pref = USER_PREFERENCES.get(context_id, {}); reply_msg = "您目前尚未訂閱每日新聞喔。"
+    if user_pref.get("subscribed_news"): subscribed_keywords = user_pref.get("news_keywords", "預設 AI 主題"); reply_msg = f"您目前的訂閱狀態為：\n- 狀態：已訂閱 ✅\n- 主題：「{subscribed_keywords}」"
+    send_line_messages(context_id, reply_token, [reply_msg])
+
+def _handle_unsubscribe_command(context_id, reply_token, command_text, rest):
+    user_pref = dict(USER_PREFERENCES.get(context_id, {})); user_pref["subscribed_news"] = False
+    record_preference(context_id, user_pref); send_line_messages(context_id, reply_token, ["☑️ 好的，已為您取消每日新聞訂閱。"])
+
+def _handle_chat_command(context_id, reply_token, command_text, rest):
+    logging.info("作為一般聊天問題處理。")
+    llm_response = generate_chat_response(context_id, command_text)
+    
+    parsed_result = handle_llm_response_with_think(llm_response)
+    thinking_messages = parsed_result["thinking_messages"]
+    messages_to_send = thinking_messages
+    messages_to_send.extend(parsed_result["formal_messages"])
+    send_line_messages(context_id, reply_token, messages_to_send)
+    
+    if not llm_response.startswith("抱歉，"):
+        # 紀錄保存未切割的原文，不必把送出用的分段 (含 (i/n) 編號) 再接回去
+        append_history_message(context_id, {
+            "role": "assistant", 
+            "content": parsed_result["formal_text"],
+            "timestamp": datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        })
+
+COMMAND_HANDLERS = {
+    "新聞": _handle_news_command,
+    "news": _handle_news_command,
+    "新聞摘要": _handle_news_command,
+    "訂閱": _handle_subscribe_command,
+    "查看訂閱": _handle_view_subscription_command,
+    "取消訂閱": _handle_unsubscribe_command,
+}
+
 def handle_text_message_event(context_id, user_id, reply_token, user_text):
-    display_name = get_user_profile(context_id, user_id)
-    if context_id.startswith(('G', 'R')): formatted_message_content = f"{display_name}: {user_text}"
+    user_text_stripped = user_text.strip()
+    is_command = user_text_stripped.startswith(Config.BOT_TRIGGER_WORD)
+    # 不是對機器人下的指令時預設直接結束，不查詢成員名稱也不寫入對話紀錄，除非開啟 RECORD_ALL_MESSAGES
+    if not is_command and not Config.RECORD_ALL_MESSAGES: return
+
+    if context_id.startswith(('G', 'R')): formatted_message_content = f"{get_user_profile(context_id, user_id)}: {user_text}"
     else: formatted_message_content = user_text
-    history = CONVERSATION_HISTORY.get(context_id, [])
-    history.append({
+    history = append_history_message(context_id, {
         "role": "user", 
         "content": formatted_message_content,
         "timestamp": datetime.now().strftime('%Y-%m-%d %H:%M:%S')
     })
-    if len(history) > MAX_HISTORY_MESSAGES: history = history[-MAX_HISTORY_MESSAGES:]
-    CONVERSATION_HISTORY[context_id] = history
-    save_json_data(CONVERSATION_HISTORY, CONVERSATION_HISTORY_FILE)
     logging.info(f"已記錄訊息到 {context_id}。當前歷史長度: {len(history)}")
 
-    user_text_stripped = user_text.strip()
-    if not user_text_stripped.startswith(BOT_TRIGGER_WORD): return
+    if not is_command: return
 
-    command_text = user_text_stripped[len(BOT_TRIGGER_WORD):].strip()
+    command_text = user_text_stripped[len(Config.BOT_TRIGGER_WORD):].strip()
     if not command_text or command_text.lower() in ["help", "幫助", "指令"]:
-        send_line_messages(context_id, reply_token, [HELP_MESSAGE.strip()]); return
+        send_line_messages(context_id, reply_token, [HELP_MESSAGE]); return
 
-    cmd_parts = command_text.lower().split()
-    main_command = cmd_parts[0] if cmd_parts else ""
+    # 只需要第一個字詞判斷指令，不必把整段訊息轉小寫再全部切開
+    first_token = command_text.split(maxsplit=1)[0]
+    main_command = first_token.lower()
+    # 指令後的其餘內容以原始字詞長度切出，大小寫轉換不會影響位置
+    rest = command_text[len(first_token):].strip()
 
-    if main_command in ["新聞", "news", "新聞摘要"]:
-        logging.info("偵測到「新聞一次性查詢」指令。")
-        final_keywords = None; user_input_part = command_text[len(main_command):].strip()
-        if user_input_part:
-            if user_input_part.lower().startswith("關鍵字:"): final_keywords = user_input_part[len("關鍵字:"):].strip()
-            else: final_keywords = user_input_part
-        else:
-            user_pref = USER_PREFERENCES.get(context_id, {});
-            if user_pref.get("subscribed_news") and user_pref.get("news_keywords"): final_keywords = user_pref.get("news_keywords")
-        if not final_keywords: final_keywords = None
-        # 使用背景執行緒處理，避免 webhook 超時
-        thread = ThreadPoolExecutor(max_workers=1)
-        thread.submit(generate_and_push_news_for_user, user_id=context_id, user_custom_keywords=final_keywords, is_immediate_push=True, reply_token=reply_token)
-        # 立刻回覆一個處理中訊息
-        send_line_messages(context_id, reply_token, ["收到！正在為您客製化新聞摘要，請稍候... 🚀"])
-
-
-    elif main_command == "訂閱":
-        logging.info("偵測到「訂閱」指令。")
-        keywords_to_subscribe = command_text[len(main_command):].strip()
-        user_pref = USER_PREFERENCES.get(context_id, {}); user_pref["subscribed_news"] = True; user_pref["news_keywords"] = keywords_to_subscribe or None
-        reply_msg = f"✅ 設定成功！已為您訂閱每日新聞，主題為：「{keywords_to_subscribe or '預設 AI 主題'}」。"
-        USER_PREFERENCES[context_id] = user_pref; save_json_data(USER_PREFERENCES, USER_PREFERENCES_FILE)
-        send_line_messages(context_id, reply_token, [reply_msg])
-
-    elif main_command == "查看訂閱":
-        user_pref = USER_PREFERENCES.get(context_id, {}); reply_msg = "您目前尚未訂閱每日新聞喔。"
-        if user_pref.get("subscribed_news"): subscribed_keywords = user_pref.get("news_keywords", "預設 AI 主題"); reply_msg = f"您目前的訂閱狀態為：\n- 狀態：已訂閱 ✅\n- 主題：「{subscribed_keywords}」"
-        send_line_messages(context_id, reply_token, [reply_msg])
-
-    elif main_command == "取消訂閱":
-        user_pref = USER_PREFERENCES.get(context_id, {}); user_pref["subscribed_news"] = False; USER_PREFERENCES[context_id] = user_pref
-        save_json_data(USER_PREFERENCES, USER_PREFERENCES_FILE); send_line_messages(context_id, reply_token, ["☑️ 好的，已為您取消每日新聞訂閱。"])
-        
-    else:
-        logging.info("作為一般聊天問題處理。")
-        llm_response = generate_chat_response(context_id, command_text)
-        
-        parsed_result = handle_llm_response_with_think(llm_response)
-        thinking_messages = parsed_result["thinking_messages"]
-        formal_messages = parsed_result["formal_messages"]
-        messages_to_send = thinking_messages + formal_messages
-        send_line_messages(context_id, reply_token, messages_to_send)
-        
-        if not llm_response.startswith("抱歉，"):
-            cleaned_bot_response = "\n".join(formal_messages)
-            history.append({
-                "role": "assistant", 
-                "content": cleaned_bot_response,
-                "timestamp": datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-            })
-            if len(history) > MAX_HISTORY_MESSAGES:
-                history = history[-MAX_HISTORY_MESSAGES:]
-            CONVERSATION_HISTORY[context_id] = history
-            save_json_data(CONVERSATION_HISTORY, CONVERSATION_HISTORY_FILE)       
+    handler = COMMAND_HANDLERS.get(main_command, _handle_chat_command)
+    handler(context_id, reply_token, command_text, rest)
 
 # ==============================================================================
 # --- 排程與應用啟動 ---
 # ==============================================================================
-scheduler = BackgroundScheduler(timezone="Asia/Taipei", daemon=True)
+# 只有伺服器模式才需要排程器，於 __main__ 中才匯入 APScheduler 並建立；測試模式與被匯入時維持 None
+scheduler = None
 
 def daily_news_push_job():
     with app.app_context():
-        logging.info("APScheduler: 任務鏈啟動器開始執行...")
-        users_to_push = [(uid, prefs.get("news_keywords")) for uid, prefs in load_json_data(USER_PREFERENCES_FILE).items() if prefs.get("subscribed_news")]
-        if TARGET_USER_ID_FOR_TESTING and not any(u[0] == TARGET_USER_ID_FOR_TESTING for u in users_to_push):
-            users_to_push.append((TARGET_USER_ID_FOR_TESTING, load_json_data(USER_PREFERENCES_FILE).get(TARGET_USER_ID_FOR_TESTING, {}).get("news_keywords")))
+        logging.info("APScheduler: 推播批次啟動器開始執行...")
+        # 記憶體中的 USER_PREFERENCES 已包含所有變更 (檔案只是定期壓縮的備份)，不必重新讀檔
+        with _STORE_LOCK:
+            all_prefs = dict(USER_PREFERENCES)
+        users_to_push = [(uid, prefs.get("news_keywords")) for uid, prefs in all_prefs.items() if prefs.get("subscribed_news")]
+        subscribed_ids = {uid for uid, _ in users_to_push}
+        if Config.TARGET_USER_ID_FOR_TESTING and Config.TARGET_USER_ID_FOR_TESTING not in subscribed_ids:
+            users_to_push.append((Config.TARGET_USER_ID_FOR_TESTING, all_prefs.get(Config.TARGET_USER_ID_FOR_TESTING, {}).get("news_keywords")))
         if not users_to_push:
             logging.info("APScheduler: 啟動器發現沒有需要處理的用戶。")
             return
-        logging.info(f"APScheduler: 啟動器準備啟動一個包含 {len(users_to_push)} 位用戶的任務鏈。")
-        first_user_id, first_user_keywords = users_to_push[0]
-        remaining_users = users_to_push[1:]
-        job_id = f"scheduled_chain_{first_user_id}_{int(time.time())}"
-        scheduler.add_job(generate_news_for_single_user_job, 'date', run_date=datetime.now(scheduler.timezone) + timedelta(seconds=5), args=[first_user_id, first_user_keywords, remaining_users, False], id=job_id)
-        logging.info(f"APScheduler: 任務鏈的第一個任務已註冊給 {first_user_id}，啟動器任務結束。")
+        logging.info(f"APScheduler: 啟動器準備啟動一個包含 {len(users_to_push)} 位用戶的推播批次。")
+        job_id = f"scheduled_batch_{int(time.time())}"
+        scheduler.add_job(run_news_batch_job, 'date', run_date=datetime.now(scheduler.timezone) + timedelta(seconds=5), args=[users_to_push], id=job_id)
+        logging.info("APScheduler: 推播批次已註冊，啟動器任務結束。")
 
 def shutdown_scheduler_on_exit():
-    if scheduler.running: scheduler.shutdown(wait=False)
+    if scheduler and scheduler.running: scheduler.shutdown(wait=False)
 
 def _debug_test_call_openai_api():
     try:
@@ -990,6 +1867,7 @@ def _debug_test_call_openai_api():
 
 
 if __name__ == '__main__':
+    import argparse
     parser = argparse.ArgumentParser(description="Line Bot and News Fetcher")
     parser.add_argument('--test-news', action='store_true', help='Run in local test mode for news fetching and summarization.')
     parser.add_argument('--test-openai', action='store_true', help='Quickly test call_openai_api pipeline.')
@@ -1004,7 +1882,7 @@ if __name__ == '__main__':
     if args.test_news:
         def run_test_mode(keywords, limit):
             print("="*50 + "\n🚀 進入本地測試模式 🚀\n" + "="*50)
-            articles = fetch_and_parse_articles(custom_query=keywords, limit=limit or NEWS_FETCH_TARGET_COUNT)
+            articles = fetch_and_parse_articles(custom_query=keywords, limit=limit or Config.NEWS_FETCH_TARGET_COUNT)
             if not articles:
                 print("[!] 測試中止：未能成功擷取任何新聞內文。")
                 return
@@ -1019,9 +1897,11 @@ if __name__ == '__main__':
         if any(not os.getenv(var) for var in required_env_vars):
             logging.critical(f"CRITICAL: Missing required environment variables: {', '.join(v for v in required_env_vars if not os.getenv(v))}. Exiting.")
             exit(1)
+        from apscheduler.schedulers.background import BackgroundScheduler
+        scheduler = BackgroundScheduler(timezone="Asia/Taipei", daemon=True)
         if not scheduler.get_jobs():
-            scheduler.add_job(daily_news_push_job, 'cron', hour=9, minute=0, id='daily_news_cron_morning', replace_existing=True)
-            scheduler.add_job(daily_news_push_job, 'cron', hour=16, minute=0, id='daily_news_cron_afternoon', replace_existing=True)
+            scheduler.add_job(daily_news_push_job, 'cron', hour=Config.NEWS_PUSH_HOURS[0], minute=0, id='daily_news_cron_morning', replace_existing=True)
+            scheduler.add_job(daily_news_push_job, 'cron', hour=Config.NEWS_PUSH_HOURS[1], minute=0, id='daily_news_cron_afternoon', replace_existing=True)
             logging.info("已設定每日 09:00 和每日 16:00 的新聞推播排程。")
             if os.getenv("RUN_JOB_ON_STARTUP", "False").lower() == "true":
                 scheduler.add_job(daily_news_push_job, 'date', run_date=datetime.now(scheduler.timezone) + timedelta(seconds=15), id='startup_news_push')